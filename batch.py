@@ -0,0 +1,20 @@
+"""
+Author: Venkatesh Krishnamurthy. Copyright 2022.
+
+Runs the analysis in every cell folder inside a root folder, for use without
+installing the package; same as the 'rebecca-batch' command, see
+rebecca/batch.py.
+
+Usage:
+python batch.py root_folder [--workers N] [--set NAME=VALUE ...]
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from rebecca.batch import main
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Benchmark: combined profile plot drawn with one line per cycle and
+colorFader (old plot_charge_discharge_profiles) vs one LineCollection
+(draw_combined_profiles).
+
+Usage (from the repository root):
+python benchmarks/bench_combined_profiles.py [n_cycles ...]
+
+Defaults to 100, 500 and 2000 synthetic discharge profiles of 300 points.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from rebecca import pipeline
+from rebecca.colors import colorFader
+
+
+def synthetic_profiles(n_cycles, n_points=300):
+    """Discharge curves from 4.2 V to 3 V that fade by 0.05% per cycle."""
+    x = np.linspace(0, 1, n_points)
+    return {n: (x*(1 - 0.0005*n), 4.2 - 0.6*x - 0.6*x**8) for n in range(1, n_cycles + 1)}
+
+
+def legacy_combined_profiles(profiles, plot_name):
+    """Old combined plot, kept for comparison: one plt.plot call per cycle."""
+    plt.figure()
+    for counter, (q, v) in enumerate(profiles.values()):
+        plt.plot(q, v, color=colorFader(pipeline.color1, pipeline.color2, counter/len(profiles)))
+    plt.title('Discharge cycles')
+    plt.xlabel('Capacity (mAh)')
+    plt.ylabel('Voltage (V)')
+    plt.ylim(pipeline.voltage_limits)
+    plt.savefig(plot_name)
+    plt.close()
+
+
+def main():
+    sizes = [int(float(n)) for n in sys.argv[1:]] or [100, 500, 2000]
+    print('%8s %12s %12s %8s' % ('cycles', 'old (s)', 'new (s)', 'speedup'))
+    with tempfile.TemporaryDirectory() as folder:
+        for n_cycles in sizes:
+            profiles = synthetic_profiles(n_cycles)
+            start = time.perf_counter()
+            legacy_combined_profiles(profiles, os.path.join(folder, 'old.png'))
+            old = time.perf_counter() - start
+            start = time.perf_counter()
+            cycles, q, v, offsets = pipeline.pack_profiles(profiles)
+            pipeline.draw_combined_profiles(q, v, offsets, 'Discharge cycles', os.path.join(folder, 'new.png'))
+            new = time.perf_counter() - start
+            print('%8d %12.3f %12.3f %7.1fx' % (n_cycles, old, new, old/new))
+
+
+if __name__ == '__main__':
+    main()
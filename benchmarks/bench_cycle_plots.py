@@ -0,0 +1,87 @@
+"""
+Benchmark: one new figure per cycle (old plot_charge_discharge_profiles loop)
+vs one reused figure (draw_cycle_profiles) for the cycles/*.png plots.
+
+Usage (from the repository root):
+python benchmarks/bench_cycle_plots.py [path/to/file.mpr] [repeats]
+
+Defaults to the bundled test .mpr file. Plots are written to a temporary
+folder; both paths run in this process with the Agg backend.
+"""
+
+import glob
+import os
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from galvani import BioLogic
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from rebecca import pipeline
+
+
+def legacy_cycle_profiles(profiles, direction, xmax):
+    """Old per-cycle loop, kept for comparison: a new figure for every cycle.
+
+    Arguments:
+    profiles = dict of cycle: (capacity, voltage)
+    direction = 'charge' or 'discharge'
+    xmax = upper capacity limit of all plots
+
+    Returns:
+    None
+    """
+    for n, (q, v) in profiles.items():
+        plt.figure()
+        plt.plot(q, v, '-o')
+        plt.xlabel('Capacity (mAh)')
+        plt.ylabel('Voltage (V)')
+        plt.title(str(n) + '$^{th}$ ' + direction)
+        plt.ylim(pipeline.voltage_limits)
+        plt.xlim([0, xmax])
+        plt.savefig('cycles/' + direction + '_' + str(n) + '.png')
+        plt.close()
+
+
+def main():
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    filename = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else glob.glob(os.path.join(root, 'test', '*.mpr'))[0])
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    data = pd.DataFrame(BioLogic.MPRfile(filename).data)
+    data.drop(data[data['dQ/mA.h'] == 0].index, inplace=True)
+    profiles = pipeline.split_profiles(data, pipeline.build_half_cycle_index(data))
+    n_plots = sum(len(profiles[direction]) for direction in profiles)
+    print('File: ' + os.path.basename(filename))
+    print('%d per-cycle plots' % n_plots)
+
+    def new(direction, xmax):
+        cycles, q, v, offsets = pipeline.pack_profiles(profiles[direction])
+        pipeline.draw_cycle_profiles(cycles, q, v, offsets, direction, xmax)
+
+    timings = {}
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        os.makedirs('cycles')
+        for label, func in [
+                ('old (figure per cycle)', lambda d, xmax: legacy_cycle_profiles(profiles[d], d, xmax)),
+                ('new (reused figure)', new)]:
+            best = np.inf
+            for _ in range(repeats):
+                start = time.perf_counter()
+                for direction in ('discharge', 'charge'):
+                    func(direction, max(q.max() for q, v in profiles[direction].values()))
+                best = min(best, time.perf_counter() - start)
+            timings[label] = best
+            print('%-24s %8.3f s  (%.1f plots/s)' % (label, best, n_plots/best))
+        os.chdir(root)
+    print('Speedup: %.1fx' % (timings['old (figure per cycle)']/timings['new (reused figure)']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark: render time of a 16x4 inch time series plot vs number of points,
+drawing all points or only the points picked by decimate_indices.
+
+Usage (from the repository root):
+python benchmarks/bench_decimation.py [n_points ...]
+
+Defaults to 1e4, 1e5, 1e6 and 5e6 points of a synthetic cycling voltage
+signal with random spikes.
+"""
+
+import io
+import os
+import sys
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from rebecca import pipeline
+
+
+def synthetic_voltage(n_points, n_cycles=500, seed=0):
+    """Triangle wave between 3 and 4.2 V with noise and a few spikes,
+    sampled at n_points uniformly spaced times (s)."""
+    rng = np.random.default_rng(seed)
+    time_s = np.linspace(0, n_cycles*7200, n_points)
+    phase = (time_s/7200) % 1
+    voltage = 3 + 1.2*(1 - np.abs(2*phase - 1)) + rng.normal(0, 0.002, n_points)
+    spikes = rng.integers(0, n_points, 20)
+    voltage[spikes] += rng.choice([-1, 1], 20)*0.5
+    return time_s, voltage
+
+
+def render(time_s, voltage):
+    """Render the plot to an in-memory PNG and return the time taken."""
+    start = time.perf_counter()
+    plt.figure(figsize=(16,4))
+    plt.plot(time_s/3600, voltage)
+    plt.xlim([0, time_s.max()/3600])
+    plt.xlabel('Time (hr)')
+    plt.ylabel('Ewe/V')
+    plt.savefig(io.BytesIO(), format='png', bbox_inches='tight')
+    plt.close()
+    return time.perf_counter() - start
+
+
+def main():
+    counts = [int(float(n)) for n in sys.argv[1:]] or [10**4, 10**5, 10**6, 5*10**6]
+    n_buckets = 2*16*int(matplotlib.rcParams['figure.dpi'])
+    print('%12s %12s %12s %14s %12s' % ('points', 'drawn', 'all (s)', 'decimated (s)', 'speedup'))
+    for n_points in counts:
+        time_s, voltage = synthetic_voltage(n_points)
+        t_all = render(time_s, voltage)
+
+        start = time.perf_counter()
+        points = pipeline.decimate_indices(pipeline.pixel_buckets(time_s, n_buckets), voltage)
+        t_decimated = time.perf_counter() - start + render(time_s[points], voltage[points])
+
+        # Spikes must survive decimation
+        assert voltage[points].max() == voltage.max() and voltage[points].min() == voltage.min()
+        print('%12d %12d %12.3f %14.3f %11.1fx' % (n_points, len(points), t_all, t_decimated, t_all/t_decimated))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark: per-row dQ/dV loop (old save_dQ_dV_data) vs vectorized compute_dqdv.
+
+Usage (from the repository root):
+python benchmarks/bench_dqdv.py [path/to/file.mpr] [repeats]
+
+Defaults to the bundled test .mpr file. Checks that both paths give
+identical output for every half cycle before reporting timings.
+"""
+
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from galvani import BioLogic
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from rebecca import pipeline
+
+
+def legacy_dqdv(data, tol):
+    """Old save_dQ_dV_data filter and forward difference, kept for comparison.
+
+    Arguments:
+    data = pandas dataframe with 'charge', 'voltage' columns
+    tol = absolute voltage tolerance
+
+    Returns:
+    v, dqdv = lists of filtered voltages and dQ/dV
+    """
+    q = []
+    v = []
+    q.append(data['charge'].iloc[0])
+    v.append(data['voltage'].iloc[0])
+    for i in range(1, len(data)):
+        if abs(data['voltage'].iloc[i] - v[-1]) >= tol:
+            q.append(data['charge'][i])
+            v.append(data['voltage'][i])
+
+    dqdv = [0]
+    for i in range(1, len(q)-1):
+        dqdv.append( (q[i+1] - q[i])/(v[i+1]-v[i]) )
+    dqdv.append(0)
+    return v, dqdv
+
+
+def load_profiles(filename):
+    """Splits an .mpr file into the per-half-cycle (capacity, voltage)
+    dataframes that plot.py writes to cycles/*.csv."""
+    data = pd.DataFrame(BioLogic.MPRfile(filename).data)
+    data.drop(data[data['dQ/mA.h'] == 0].index, inplace=True)
+    profiles = pipeline.split_profiles(data, pipeline.build_half_cycle_index(data))
+    return [pd.DataFrame({'charge': q, 'voltage': v})
+            for direction in ('charge', 'discharge') for q, v in profiles[direction].values()]
+
+
+def main():
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    filename = sys.argv[1] if len(sys.argv) > 1 else glob.glob(os.path.join(root, 'test', '*.mpr'))[0]
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    profiles = load_profiles(filename)
+    rows = sum(len(p) for p in profiles)
+    print('File: ' + os.path.basename(filename))
+    print('%d half cycles, %d rows, dqdv_tol = %g V' % (len(profiles), rows, pipeline.dqdv_tol))
+
+    # Check that both paths give identical output
+    for p in profiles:
+        v_old, dqdv_old = legacy_dqdv(p, pipeline.dqdv_tol)
+        v_new, dqdv_new = pipeline.compute_dqdv(p['charge'].to_numpy(), p['voltage'].to_numpy(), pipeline.dqdv_tol)
+        assert np.array_equal(np.array(v_old), v_new)
+        assert np.array_equal(np.array(dqdv_old, dtype=float), dqdv_new)
+    print('Outputs identical.')
+
+    timings = {}
+    for label, func in [
+            ('old (per-row loop)', lambda p: legacy_dqdv(p, pipeline.dqdv_tol)),
+            ('new (vectorized)', lambda p: pipeline.compute_dqdv(
+                p['charge'].to_numpy(), p['voltage'].to_numpy(), pipeline.dqdv_tol))]:
+        best = np.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for p in profiles:
+                func(p)
+            best = min(best, time.perf_counter() - start)
+        timings[label] = best
+        print('%-20s %10.4f s  (%.0f rows/s)' % (label, best, rows/best))
+    print('Speedup: %.1fx' % (timings['old (per-row loop)']/timings['new (vectorized)']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark: comparing many cells by reading main_out/*.txt of each cell in a
+loop (old notebook way) vs fleet.py, which reads the binary per-cycle summary
+of all cells in parallel into one table.
+
+Usage (from the repository root):
+python benchmarks/bench_fleet.py [n_cells] [n_cycles]
+
+Defaults to 300 synthetic cells of 1000 cycles, written to a temporary
+folder. Checks that both ways give the same cycles to 80%.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from rebecca import fleet
+from rebecca.cycle_store import write_store
+
+
+def write_cells(root, n_cells, n_cycles):
+    """Cells that fade linearly at different rates, with noisy CE."""
+    rng = np.random.default_rng(0)
+    cycles = np.arange(1, n_cycles + 1)
+    for i in range(n_cells):
+        disch = 2*(1 - rng.uniform(1e-4, 5e-4)*cycles)
+        summary = pd.DataFrame({'cycle': cycles, 'charge capacity/mA.h': disch*1.002,
+                                'discharge capacity/mA.h': disch,
+                                'coulombic efficiency/%': 99.8 + rng.normal(0, 0.05, n_cycles)})
+        out = os.path.join(root, 'cell_%03d' % i, 'main_out')
+        os.makedirs(out)
+        write_store(os.path.join(out, 'cycle_store'), {}, {}, {}, summary)
+        summary.to_csv(os.path.join(out, 'cycle_summary.csv'), index=False)
+        np.savetxt(os.path.join(out, 'discharge_capacities.txt'), summary['discharge capacity/mA.h'])
+        np.savetxt(os.path.join(out, 'coulombic_efficiencies.txt'), summary['coulombic efficiency/%'])
+
+
+def legacy_fleet(root):
+    """Old way, kept for comparison: a loop over cells re-parsing text files."""
+    cycles_to_80 = {}
+    ce = []
+    for name in sorted(os.listdir(root)):
+        disch = np.loadtxt(os.path.join(root, name, 'main_out', 'discharge_capacities.txt'))
+        ce.append(np.loadtxt(os.path.join(root, name, 'main_out', 'coulombic_efficiencies.txt')))
+        below = np.flatnonzero(100*disch/disch[0] < 80)
+        cycles_to_80[name] = below[0] + 1 if len(below) else np.nan
+    bands = np.percentile(np.array(ce), (5, 25, 50, 75, 95), axis=0)
+    return pd.Series(cycles_to_80), bands
+
+
+def main():
+    n_cells = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    n_cycles = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    with tempfile.TemporaryDirectory() as root:
+        write_cells(root, n_cells, n_cycles)
+        print('%d cells, %d cycles each' % (n_cells, n_cycles))
+
+        start = time.perf_counter()
+        old_cycles, old_bands = legacy_fleet(root)
+        old = time.perf_counter() - start
+
+        start = time.perf_counter()
+        table = fleet.load_fleet(fleet.find_cells(root))
+        load = time.perf_counter() - start
+        new_cycles = fleet.cycles_to_threshold(table, 80)
+        bands = fleet.percentile_bands(table)
+        new = time.perf_counter() - start
+        assert np.allclose(old_cycles.to_numpy(), new_cycles.to_numpy(), equal_nan=True)
+        assert np.allclose(old_bands.T, bands.iloc[:, 1:].to_numpy())
+        print('Cycles to 80% and CE bands identical.')
+        print('%-36s %8.3f s' % ('old (text files, loop over cells)', old))
+        print('%-36s %8.3f s' % ('new load_fleet', load))
+        print('%-36s %8.3f s' % ('new load_fleet + comparisons', new))
+
+
+if __name__ == '__main__':
+    main()
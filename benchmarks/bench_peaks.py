@@ -0,0 +1,69 @@
+"""
+Benchmark: finding the 3 highest dQ/dV peaks of every cycle with
+peaks.find_peaks (all cycles in one call) for a growing number of cycles,
+and, if scipy is installed, with scipy.signal.find_peaks and peak_widths
+called once per cycle.
+
+Usage (from the repository root):
+python benchmarks/bench_peaks.py [n_cycles ...]
+
+Defaults to 1000, 2000 and 4000 synthetic noisy cycles of 500 points. The
+time per cycle of the batched version should stay about the same.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from rebecca.peaks import find_peaks
+
+try:
+    from scipy import signal
+except ImportError:
+    signal = None
+
+
+def synthetic_dqdv(n_cycles, n_points=500):
+    """Two Gaussian peaks that shift and shrink with cycling, plus noise."""
+    rng = np.random.default_rng(0)
+    x = np.linspace(3, 4.2, n_points)
+    n = np.arange(n_cycles)[:, None]
+    y = (3*np.exp(-((x - 3.6 - 1e-5*n)/0.03)**2) + np.exp(-((x - 3.9 + 1e-5*n)/0.05)**2))*(1 - 1e-4*n)
+    y = y + rng.normal(0, 0.01, y.shape)
+    return np.tile(x, n_cycles), y.ravel(), np.arange(n_cycles + 1)*n_points
+
+
+def scipy_peaks(x, y, offsets, n_peaks=3):
+    """Per-cycle peaks with scipy, widths at half height from zero."""
+    widths = []
+    for start, stop in zip(offsets[:-1], offsets[1:]):
+        yy = y[start:stop]
+        peaks = signal.find_peaks(yy)[0]
+        peaks = peaks[np.argsort(-yy[peaks], kind='stable')[:n_peaks]]
+        base = (yy[peaks], np.zeros(len(peaks), dtype=np.intp), np.full(len(peaks), len(yy) - 1, dtype=np.intp))
+        widths.append(signal.peak_widths(yy, peaks, 0.5, base)[0]*(x[start + 1] - x[start]))
+    return np.concatenate(widths)
+
+
+def main():
+    sizes = [int(float(n)) for n in sys.argv[1:]] or [1000, 2000, 4000]
+    print('%8s %12s %14s %12s' % ('cycles', 'batched (s)', 'per cycle (us)', 'scipy (s)'))
+    for n_cycles in sizes:
+        x, y, offsets = synthetic_dqdv(n_cycles)
+        start = time.perf_counter()
+        width = find_peaks(x, y, offsets, 3)[4]
+        new = time.perf_counter() - start
+        old = float('nan')
+        if signal is not None:
+            start = time.perf_counter()
+            expected = scipy_peaks(x, y, offsets, 3)
+            old = time.perf_counter() - start
+            assert np.allclose(width, expected)
+        print('%8d %12.3f %14.1f %12.3f' % (n_cycles, new, 1e6*new/n_cycles, old))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Benchmark: time every stage of the analysis on synthetic tests of increasing size,
+and compare with saved baseline timings so that slowdowns show up as numbers.
+
+Each size in the matrix of cycles x points per half cycle is generated with
+synthetic.py and run through pipeline.run in a temporary folder, with figures
+rendered in the main process (render_workers = 1) so that drawing time is
+counted in the stage that draws. Stage timings come from the stage records
+the pipeline writes to main_out/stage_report.json.
+
+Usage (from the repository root):
+python benchmarks/bench_pipeline.py [--cycles N ...] [--points N ...]
+                                    [--repeat N] [--save-baseline]
+                                    [--baseline file] [--tolerance 1.5]
+
+Defaults to 100, 1000 and 5000 cycles of 100 and 500 points per half cycle
+(up to 5.1M rows), best of 1 run. Stages more than --tolerance times slower
+than in the baseline (and by more than 50 ms) are flagged. --save-baseline
+writes the timings to the baseline file (default benchmarks/baseline.json)
+instead of comparing with it. Baselines saved before the stages were renamed
+(rebecca 0.1) are compared by adding up the new stages that make up each
+old one, see OLD_STAGES.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+
+import matplotlib
+matplotlib.use('Agg')
+# The package imports pyplot on first use; import it here so that its import
+# time is not counted in the first stage that plots
+import matplotlib.pyplot
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from rebecca import pipeline
+from synthetic import synthetic_data
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# Old stage name (before the stage graph) that each stage was part of
+OLD_STAGES = {'load': 'data_tailor', 'time_series': 'plot_all_time_series',
+              'voltage_capacity': 'plot_voltage_capacity_ref_initial',
+              'ocv_filter': 'split_profiles', 'segment': 'split_profiles', 'profiles': 'split_profiles',
+              'capacities': 'summarize_cycles', 'capacity_files': 'summarize_cycles',
+              'capacity_plots': 'plot_capacity_vs_cycle', 'profile_plots': 'plot_charge_discharge_profiles',
+              'dqdv': 'compute_dQ_dV_data', 'dvdq': 'compute_dV_dQ_data',
+              'dqdv_heatmaps': 'plot_dqdv_heatmaps', 'dqdv_peaks': 'track_dqdv_peaks',
+              'cycle_store': 'write_store', 'cycles_csv': 'save_cycles_data',
+              'wait_for_figures': 'wait_for_figures'}
+
+
+def run_size(n_cycles, points, repeat=1):
+    """
+    Function to run pipeline.run on one synthetic test.
+
+    Arguments:
+    n_cycles = number of cycles
+    points = points per half cycle while current flows
+    repeat = number of runs; the fastest time of each stage is kept
+
+    Returns:
+    dict of stage name: (wall time in seconds, rows processed)
+    """
+    data = synthetic_data(n_cycles, points)
+    best = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for i in range(repeat):
+            with contextlib.redirect_stdout(io.StringIO()):
+                pipeline.run(folder, data.copy(), render_workers=1, incremental=False, stage_report=False)
+            for record in pipeline._stage_records:
+                name = record['stage']
+                if name not in best or record['wall time/s'] < best[name][0]:
+                    best[name] = (record['wall time/s'], record['rows'])
+    return best
+
+
+def old_stages(stages):
+    """
+    Function to add up the timings of the stages that make up each stage of a
+    baseline saved with the old stage names.
+
+    Arguments:
+    stages = dict of stage name: {'wall time/s', 'rows'}
+
+    Returns:
+    dict of old stage name: {'wall time/s', 'rows'}; rows are those of the
+    first stage of each old stage
+    """
+    grouped = {}
+    for name, stage in stages.items():
+        old = grouped.setdefault(OLD_STAGES.get(name, name), {'wall time/s': 0.0, 'rows': stage['rows']})
+        old['wall time/s'] = round(old['wall time/s'] + stage['wall time/s'], 4)
+    return grouped
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time every stage of the analysis on synthetic tests.')
+    parser.add_argument('--cycles', type=int, nargs='+', default=[100, 1000, 5000], help='numbers of cycles')
+    parser.add_argument('--points', type=int, nargs='+', default=[100, 500], help='points per half cycle')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per size; the fastest is kept')
+    parser.add_argument('--save-baseline', action='store_true', help='save the timings as the new baseline')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline file (default: benchmarks/baseline.json)')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='flag stages that are this many times slower than the baseline')
+    args = parser.parse_args()
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['sizes']
+
+    results = {}
+    regressions = 0
+    for n_cycles in args.cycles:
+        for points in args.points:
+            key = '%d cycles x %d points' % (n_cycles, points)
+            results[key] = stages = {name: {'wall time/s': round(wall, 4), 'rows': rows}
+                                     for name, (wall, rows) in run_size(n_cycles, points, args.repeat).items()}
+            compared = stages
+            if any(name not in stages for name in baseline.get(key, {})):
+                compared = old_stages(stages)
+            print('\n' + key)
+            print('%-34s %12s %10s %10s' % ('stage', 'rows', 'time (s)', 'baseline'))
+            for name, stage in compared.items():
+                old = baseline.get(key, {}).get(name, {}).get('wall time/s')
+                flag = ''
+                if old is not None and stage['wall time/s'] > args.tolerance*old and stage['wall time/s'] - old > 0.05:
+                    flag = '  SLOWER'
+                    regressions += 1
+                print('%-34s %12s %10.3f %10s%s' % (name, stage['rows'], stage['wall time/s'],
+                                                    '-' if old is None else '%.3f' % old, flag))
+            old_total = sum(stage['wall time/s'] for stage in baseline.get(key, {}).values())
+            print('%-34s %12s %10.3f %10s' % ('total', '', sum(stage['wall time/s'] for stage in stages.values()),
+                                              '%.3f' % old_total if old_total else '-'))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'cpus': os.cpu_count(), 'sizes': results}, f, indent=1)
+            f.write('\n')
+        print('\nSaved baseline to ' + args.baseline)
+    elif baseline:
+        print('\n%d stage(s) more than %gx slower than the baseline.' % (regressions, args.tolerance))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark: smoothing dQ/dV of every cycle of a cell, one pandas DataFrame
+per cycle (old smoothen_dqdv in python_pp/) vs one batched call of
+smoothing.smooth on the concatenated cycles.
+
+Usage (from the repository root):
+python benchmarks/bench_smoothing.py [n_cycles] [points_per_cycle]
+
+Defaults to 1000 synthetic cycles of 500 points. Checks that the batched
+rolling mean matches pandas before reporting timings.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from rebecca.smoothing import METHODS, smooth
+
+
+def legacy_rolling(x, y, offsets):
+    """Old per-cycle smoothing, kept for comparison: rolling(3).mean() of a
+    DataFrame built for each cycle."""
+    smoothed = []
+    for start, stop in zip(offsets[:-1], offsets[1:]):
+        data = pd.DataFrame({'voltage': x[start:stop], 'dqdv': y[start:stop]})
+        data['dqdv'] = data['dqdv'].rolling(3).mean()
+        smoothed.append(data['dqdv'].to_numpy())
+    return np.concatenate(smoothed)
+
+
+def main():
+    n_cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_points = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    rng = np.random.default_rng(0)
+    x = np.tile(np.linspace(3, 4.2, n_points), n_cycles)
+    y = np.exp(-((x - 3.7)/0.05)**2) + rng.normal(0, 0.05, len(x))
+    offsets = np.arange(n_cycles + 1)*n_points
+    print('%d cycles, %d points' % (n_cycles, len(x)))
+
+    start = time.perf_counter()
+    old = legacy_rolling(x, y, offsets)
+    old_time = time.perf_counter() - start
+    new = smooth(x, y, offsets, 'rolling', 3)
+    assert np.allclose(old, new, rtol=0, atol=1e-12, equal_nan=True)
+    print('Rolling means identical.')
+    print('%-32s %8.3f s' % ('old rolling (DataFrame per cycle)', old_time))
+
+    for method in METHODS:
+        start = time.perf_counter()
+        smooth(x, y, offsets, method, 3 if method == 'rolling' else 11)
+        print('%-32s %8.3f s' % ('new ' + method + ' (batched)', time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Synthetic cycling data shaped like the dataframe galvani reads from a
+Biologic GCPL .mpr file, for benchmarking the analysis on tests of any size.
+
+The data has the same columns and dtypes as the bundled test file. Each
+cycle is a discharge then a charge, starting with a discharge like the test
+file. Every half cycle has its own 'half cycle' number and is followed by an
+OCV rest in the same half cycle, where 'dQ/mA.h' is 0 and the voltage
+relaxes; 'Q charge/discharge/mA.h' restarts from 0 in each half cycle and is
+negative on discharge. Capacity fades linearly with cycle number.
+
+Usage, from a script in benchmarks/:
+from synthetic import synthetic_data
+data = synthetic_data(n_cycles=1000, points=200)
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def ocv(soc):
+    """Open circuit voltage (V) vs state of charge, 3.0 V empty to 4.2 V full."""
+    return 3.4 + 0.6*soc + 0.2*soc**8 - 0.4*(1 - soc)**8
+
+
+def synthetic_data(n_cycles=100, points=200, rest_points=10, capacity=2.0, current=1.0, fade=2e-4, seed=0):
+    """
+    Function to generate a galvanostatic cycling test.
+
+    Arguments:
+    n_cycles = number of discharge/charge cycles
+    points = number of points per half cycle while current flows
+    rest_points = number of OCV points at the end of each half cycle
+    capacity = capacity of the first cycle (mAh)
+    current = current (mA)
+    fade = capacity lost per cycle, as a fraction of capacity
+    seed = seed of the voltage noise
+
+    Returns:
+    pandas dataframe with the columns of a galvani GCPL dataframe and
+    n_cycles*2*(points + rest_points) rows
+    """
+    rng = np.random.default_rng(seed)
+    n_half = 2*n_cycles
+    per_half = points + rest_points
+    half = np.repeat(np.arange(n_half), per_half)
+    discharge = half % 2 == 0
+    step = np.tile(np.arange(per_half), n_half)
+    resting = step >= points
+    half_capacity = capacity*(1 - fade*(np.arange(n_half)//2))
+
+    # Fraction of the half cycle's capacity passed, constant during the rest
+    passed = np.minimum(step + 1, points)/points
+    q = np.where(discharge, -1, 1)*half_capacity[half]*passed
+    dq = np.where(resting, 0, np.where(discharge, -1, 1)*half_capacity[half]/points)
+    soc = np.where(discharge, 1 - passed, passed)
+    # Overpotential while current flows, relaxing exponentially during the rest
+    relax = np.where(resting, np.exp(-(step - points + 1)/3), 1)
+    voltage = ocv(soc) + np.where(discharge, -0.05, 0.05)*relax + rng.normal(0, 1e-4, len(half))
+    control = np.where(resting, 0, np.where(discharge, -current, current))
+    dt = np.where(resting, 60, 3600*half_capacity[half]/points/current)
+    energy = np.abs(dq)*voltage/1000
+    # Energy restarts from 0 in each half cycle, like the charge
+    cumulative_energy = np.cumsum(energy)
+    cumulative_energy -= np.repeat(cumulative_energy[::per_half] - energy[::per_half], per_half)
+
+    return pd.DataFrame({
+        'flags': np.where(resting, 19, 1).astype(np.uint8),
+        'Ns': np.where(discharge, 1, 2).astype(np.uint16),
+        'time/s': np.cumsum(dt) - dt[0],
+        'dQ/mA.h': dq,
+        '(Q-Qo)/mA.h': np.cumsum(dq),
+        'control/V/mA': control.astype(np.float32),
+        'Ewe/V': voltage.astype(np.float32),
+        'I Range': np.full(len(half), 14, dtype=np.uint16),
+        'Q charge/discharge/mA.h': q,
+        'half cycle': half.astype(np.uint32),
+        'P/W': (voltage*control/1000).astype(np.float32),
+        'Energy charge/W.h': np.where(discharge, 0, cumulative_energy),
+        'Energy discharge/W.h': np.where(discharge, cumulative_energy, 0),
+        'Capacitance charge/µF': np.zeros(len(half)),
+        'Capacitance discharge/µF': np.zeros(len(half)),
+    })
@@ -11,6 +11,7 @@ rm -r time_series/
 rm -r cycles/
 rm -r main_out/
 rm -r pretty_plots/
+rm -r .rebecca_cache/
 
 rm plot.py
 rm cleanup.sh
@@ -3,33 +3,40 @@ Plots charge, discharge capacity vs cycles.
 Also plots CE vs cycles in separate plot.
 """
 
-import pandas as pd
+import os
+import sys
+
 import numpy as np
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from rebecca.cycle_store import CycleStore
+
 color1 = '#1672c0'
 color2 = '#c01672'
 color_CE = '#72c016'
 CE_100pc_line = True
 
-ch_data = pd.read_csv('main_out/charge_capacities.txt', names=['cap'])
-disch_data = pd.read_csv('main_out/discharge_capacities.txt', names=['cap'])
-ce_data = pd.read_csv('main_out/coulombic_efficiencies.txt', names=['CE'])
+# Per-cycle table of main_out/cycle_summary.csv; NaN where a cycle has no charge or discharge
+summary = CycleStore().summary
+ch_cap = summary['charge capacity/mA.h'][~np.isnan(summary['charge capacity/mA.h'])]
+disch_cap = summary['discharge capacity/mA.h'][~np.isnan(summary['discharge capacity/mA.h'])]
+ce = summary['coulombic efficiency/%'][~np.isnan(summary['coulombic efficiency/%'])]
 
 
 # Plot charge, discharge capacity vs cycles
 fig = plt.figure(linewidth=1.5, figsize=(6,5))
 ax1 = fig.add_subplot(111)
 
-ax1.plot(np.arange(1, len(ch_data)+1) , ch_data['cap'], 
+ax1.plot(np.arange(1, len(ch_cap)+1) , ch_cap, 
 label='Charge', linestyle='solid', 
 color=color1, linewidth=3, markersize=15)
-ax1.plot(np.arange(1, len(disch_data)+1), disch_data['cap'], 
+ax1.plot(np.arange(1, len(disch_cap)+1), disch_cap, 
 label='Discharge', linestyle='solid',
 color=color2, linewidth=3, markersize=15)
 
-plt.xlim([0, max(len(ch_data), len(disch_data))])
-plt.ylim([0, 1.05*max(max(ch_data['cap']), max(disch_data['cap']))])
+plt.xlim([0, max(len(ch_cap), len(disch_cap))])
+plt.ylim([0, 1.05*max(max(ch_cap), max(disch_cap))])
 
 plt.xlabel('Cycle number',
 fontweight='bold', fontname='Times New Roman', fontsize=20)
@@ -53,13 +60,13 @@ plt.close()
 # Plot CE vs cycles
 fig = plt.figure(linewidth=1.5, figsize=(6,5))
 ax1 = fig.add_subplot(111)
-ax1.plot(np.arange(1, len(ce_data)+1), ce_data['CE'], 
+ax1.plot(np.arange(1, len(ce)+1), ce, 
 label='CE', linestyle='solid',
 color=color_CE, linewidth=3, markersize=15)
 if CE_100pc_line:
     ax1.axhline(y=100, color='k', linestyle='dashed', linewidth=1)
 
-plt.xlim([0, len(ce_data['CE'])])
+plt.xlim([0, len(ce)])
 plt.xlabel('Cycle number',
 fontweight='bold', fontname='Times New Roman', fontsize=20)
 plt.ylabel('Coulombic efficiency (%)',
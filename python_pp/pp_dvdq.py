@@ -1,65 +1,44 @@
-import pandas as pd
-import matplotlib as mpl
+import os
+import sys
+
 import matplotlib.pyplot as plt
 import numpy as np
 
-def colorFader(c1,c2,mix=0):
-    """Function to interpolate between two chosen colors.
-    fade (linear interpolate) from color c1 (at mix=0) to c2 (mix=1)"""
-    c1=np.array(mpl.colors.to_rgb(c1))
-    c2=np.array(mpl.colors.to_rgb(c2))
-    return mpl.colors.to_hex((1-mix)*c1 + mix*c2)
-
-
-def smoothen_dvdq(data, smooth_type):
-    """
-    Smoothen the dQ/dV data.
-    Currently implements rolling average of 3 and Savitzky-Golay.
-
-    Arguments:
-    data -- dataframe with V, dQ/dV as columns
-    smooth_type -- string, either 'savitzky-golay' or 'rolling'
-
-    Returns:
-    data -- dataframe with V and smoothed dQ/dV as columns.
-    """
-
-    if smooth_type == 'rolling':
-        data['dvdq'] = data['dvdq'].rolling(3).mean()
-
-    elif smooth_type == 'savitzky_golay':
-        raise NotImplementedError
-
-    return data
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from rebecca.colors import color_gradient
+from rebecca.cycle_store import CycleStore
+from rebecca.smoothing import smooth
 
 
 ###############################################################################
 cycle_nums = [5, 10]
 voltage_limits = [0, 3]         # x limits
-smooth_type = 'rolling'           # 'None', 'rolling' or 'savitzky-golay'
+smooth_type = 'rolling'           # 'None', 'rolling', 'savitzky_golay', 'gaussian' or 'lowess'
+smooth_window = 3                 # Number of points in the smoothing window
 
 dvdq_color1 = '#53a4ec'
 dvdq_color2 = '#092d4d'
 ###############################################################################
 
 
+store = CycleStore()
+capacity, dvdq = store.columns['dVdQ']
+# Smooth all cycles of the cell in one call, then pick the ones to plot
+dvdq = smooth(capacity, dvdq, store.offsets['dVdQ'], smooth_type, smooth_window)
+colors = color_gradient(dvdq_color1, dvdq_color2, np.arange(len(cycle_nums))/len(cycle_nums))
 for index, cycle_num in enumerate(cycle_nums):
-    color = colorFader(dvdq_color1, dvdq_color2, mix=index/len(cycle_nums))
+    color = colors[index]
     # Charge data
-    ch_data = pd.read_csv('cycles/charge_'+str(cycle_num)+'_dVdQ.csv', 
-    names=['capacity', 'dvdq'])
-    ch_data = smoothen_dvdq(ch_data, smooth_type)
-    plt.plot(ch_data['capacity'], ch_data['dvdq'], label='Cycle '+str(cycle_num),
+    rows = store.rows('charge', cycle_num, 'dVdQ')
+    plt.plot(capacity[rows], dvdq[rows], label='Cycle '+str(cycle_num),
     linestyle='solid', color=color, linewidth=3, markersize=15)
 
     # Horizontal line at 0
     plt.axhline(y=0, color='black', linestyle='dashed', linewidth=1.5)
 
     # Discharge data
-    disch_data = pd.read_csv('cycles/discharge_'+str(cycle_num)+'_dVdQ.csv', 
-    names=['capacity', 'dvdq'])
-    disch_data = smoothen_dvdq(disch_data, smooth_type)
-    plt.plot(disch_data['capacity'], disch_data['dvdq'],
+    rows = store.rows('discharge', cycle_num, 'dVdQ')
+    plt.plot(capacity[rows], dvdq[rows],
     linestyle='solid', color=color, linewidth=3, markersize=15)
 
 
@@ -1,8 +1,13 @@
-import pandas as pd
+import os
+import sys
+
 import numpy as np
-import matplotlib as mpl
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from rebecca.colors import color_gradient
+from rebecca.cycle_store import CycleStore
+
 
 ###############################################################################
 cycle_nums = [5, 10]
@@ -13,14 +18,6 @@ color2 = '#092d4d'
 ###############################################################################
 
 
-def colorFader(c1,c2,mix=0):
-    """Function to interpolate between two chosen colors.
-    fade (linear interpolate) from color c1 (at mix=0) to c2 (mix=1)"""
-    c1=np.array(mpl.colors.to_rgb(c1))
-    c2=np.array(mpl.colors.to_rgb(c2))
-    return mpl.colors.to_hex((1-mix)*c1 + mix*c2)
-
-
 ###############################################################################
 #               Main
 ###############################################################################
@@ -28,20 +25,22 @@ def colorFader(c1,c2,mix=0):
 fig = plt.figure(linewidth=1.5, figsize=(6,5))
 ax = fig.add_subplot(111)
 
+store = CycleStore()
+ch_profiles = store.read_cycles('charge', cycle_nums)
+disch_profiles = store.read_cycles('discharge', cycle_nums)
 ch_cap = []
 disch_cap = []
+colors = color_gradient(color1, color2, np.linspace(0, 1, len(cycle_nums)))
 for index, cycle in enumerate(cycle_nums):
-    color = colorFader(color1, color2, mix=index/(len(cycle_nums)-1) )
-    ch_data = pd.read_csv('cycles/charge_' + str(cycle) + '.csv', 
-    names = ['capacity', 'voltage'])
-    disch_data = pd.read_csv('cycles/discharge_' + str(cycle) + '.csv',
-    names = ['capacity', 'voltage'])
-    ch_cap.append(max(ch_data['capacity']))
-    disch_cap.append(max(disch_data['capacity']))
+    color = colors[index]
+    ch_capacity, ch_voltage = ch_profiles[index]
+    disch_capacity, disch_voltage = disch_profiles[index]
+    ch_cap.append(max(ch_capacity))
+    disch_cap.append(max(disch_capacity))
 
-    ax.plot(ch_data['capacity'], ch_data['voltage'], label='Cycle ' + str(cycle),
+    ax.plot(ch_capacity, ch_voltage, label='Cycle ' + str(cycle),
     linestyle='solid', color=color, linewidth=3, markersize=15)
-    ax.plot(disch_data['capacity'], disch_data['voltage'],
+    ax.plot(disch_capacity, disch_voltage,
     linestyle='solid', color=color, linewidth=3, markersize=15)
 
 plt.xlim([0, max(max(ch_cap), max(disch_cap))])
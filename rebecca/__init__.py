@@ -0,0 +1,33 @@
+"""
+Author: Venkatesh Krishnamurthy. Copyright 2022.
+
+Reduced Effort Biologic Electrochemical Cell Cycling Analyzer (REBECCA).
+
+Example:
+import rebecca
+rebecca.run('path/to/cell', plot_all_cycles=True)
+store = rebecca.CycleStore('path/to/cell/main_out/cycle_store')
+
+Modules:
+pipeline        analysis of one cell (run, settings)
+cli             'rebecca' command
+batch           run many cell folders in parallel ('rebecca-batch')
+fleet           compare many analyzed cells ('rebecca-fleet')
+cycle_store     binary store of the per-cycle data of a cell
+smoothing, peaks, colors    helpers shared by the above and python_pp/
+"""
+
+__version__ = '0.2.0'
+
+
+def __getattr__(name):
+    """Import run, SETTINGS and CycleStore on first use, so that importing
+    the package (or running one of its modules with python -m) loads only
+    what is needed."""
+    if name in ('run', 'SETTINGS'):
+        from . import pipeline
+        return getattr(pipeline, name)
+    if name == 'CycleStore':
+        from .cycle_store import CycleStore
+        return CycleStore
+    raise AttributeError("module 'rebecca' has no attribute " + repr(name))
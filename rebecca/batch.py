@@ -0,0 +1,142 @@
+"""
+Author: Venkatesh Krishnamurthy. Copyright 2022.
+
+Runs the analysis of pipeline.py in every cell folder inside a root folder,
+using a pool of worker processes. Replaces batch_exe.sh.
+
+A cell folder is any subfolder of the root folder with an .mpr file in it.
+Folders that already have a main_out/ subfolder are skipped because they have
+been executed before. The output of each run is appended to rebecca.log in
+the cell folder. Each worker imports the pipeline once and runs many cells,
+so only the first cell of a worker pays for the imports.
+
+Usage:
+rebecca-batch root_folder [--workers N] [--set NAME=VALUE ...]
+(or python -m rebecca.batch ...); settings are passed to every cell, see
+'rebecca --list-settings'. render_workers defaults to 1 here, so that cell
+workers do not start render workers of their own.
+"""
+
+import argparse
+import contextlib
+import glob
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .cli import parse_settings
+
+
+def find_cell_folders(root):
+    """
+    Function to find cell folders, i.e. subfolders with at least one .mpr file.
+
+    Argument:
+    root = path of the folder containing the cell folders
+
+    Returns:
+    Sorted list of paths of cell folders
+    """
+    folders = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and len(glob.glob(os.path.join(path, '*.mpr'))) > 0:
+            folders.append(path)
+    return folders
+
+
+def run_cell(folder, settings=None):
+    """
+    Function to run the pipeline in one cell folder; executed by a worker
+    process. Output and errors are appended to rebecca.log in the cell folder.
+
+    Arguments:
+    folder = path of the cell folder
+    settings = dict of settings for pipeline.run
+
+    Returns:
+    folder, status ('done' or 'failed'), wall time in seconds
+    """
+    from . import pipeline
+    start = time.perf_counter()
+    status = 'done'
+    with open(os.path.join(folder, 'rebecca.log'), 'a') as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            pipeline.run(folder, **(settings or {}))
+        except Exception:
+            traceback.print_exc()
+            status = 'failed'
+    return folder, status, time.perf_counter() - start
+
+
+def _init_worker():
+    """Use the non-interactive Agg backend in worker processes."""
+    os.environ['MPLBACKEND'] = 'Agg'
+
+
+def run_batch(root, workers=None, settings=None):
+    """
+    Function to run the pipeline in all cell folders inside root in parallel.
+
+    Arguments:
+    root = path of the folder containing the cell folders
+    workers = number of worker processes; defaults to the number of CPUs
+    settings = dict of settings for pipeline.run of every cell;
+    render_workers defaults to 1
+
+    Returns:
+    timings = dict of cell folder: (status, wall time in seconds)
+    """
+    start = time.perf_counter()
+    timings = {}
+    todo = []
+    for folder in find_cell_folders(root):
+        if os.path.isdir(os.path.join(folder, 'main_out')):
+            print('Skipping ' + folder + " because it's been executed before...")
+            timings[folder] = ('skipped', 0.0)
+        else:
+            todo.append(folder)
+
+    print('Executing in %d folders with %s workers...' % (len(todo), workers or os.cpu_count()))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        settings = dict({'render_workers': 1}, **(settings or {}))
+        futures = {pool.submit(run_cell, os.path.abspath(folder), settings): folder for folder in todo}
+        for future in as_completed(futures):
+            cell, status, seconds = future.result()
+            timings[futures[future]] = (status, seconds)
+            print('%-8s %8.1f s  %s' % (status, seconds, futures[future]))
+
+    total = time.perf_counter() - start
+    print('\nPer-cell timings:')
+    for folder in sorted(timings):
+        status, seconds = timings[folder]
+        print('%-8s %8.1f s  %s' % (status, seconds, folder))
+    print('Total wall time: %.1f s' % total)
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='rebecca-batch',
+                                     description='Run the analysis in every cell folder inside a root folder.')
+    parser.add_argument('root', help='folder containing one subfolder per cell')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('-s', '--set', action='append', metavar='NAME=VALUE', dest='settings',
+                        help="change a setting for every cell; can be repeated (see 'rebecca --list-settings')")
+    args = parser.parse_args(argv)
+    try:
+        settings = parse_settings(args.settings)
+    except argparse.ArgumentTypeError as error:
+        parser.error(str(error))
+    from . import pipeline
+    unknown = [name for name in settings if name not in pipeline.SETTINGS]
+    if unknown:
+        parser.error('unknown setting(s): ' + ', '.join(unknown) + "; see 'rebecca --list-settings'")
+    run_batch(args.root, args.workers, settings)
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Author: Venkatesh Krishnamurthy. Copyright 2022.
+
+Command line entry point: runs the analysis of pipeline.py on one or more
+cell folders in one process.
+
+Usage:
+rebecca [folder ...] [--set NAME=VALUE ...] [--output NAME ...]
+        [--list-settings] [--list-outputs]
+(or python -m rebecca ...) runs each folder in turn; defaults to the working
+directory. VALUE is read as a Python literal if it is one, e.g.
+--set voltage_limits=[2.5,4.3] --set save_to_video=True --set color1=blue
+--output makes only the given outputs, e.g. --output profile_plots; outputs
+that are up to date are skipped either way (see pipeline.run).
+"""
+
+import argparse
+import ast
+import sys
+
+
+def parse_settings(items):
+    """
+    Function to turn NAME=VALUE strings into a dict of settings.
+
+    Argument:
+    items = list of 'NAME=VALUE' strings; VALUE is a Python literal (number,
+    True/False/None, list, string in quotes) or else a plain string
+
+    Returns:
+    dict of name: value
+    """
+    settings = {}
+    for item in items or []:
+        name, sep, value = item.partition('=')
+        if not sep:
+            raise argparse.ArgumentTypeError('Expected NAME=VALUE, not ' + repr(item))
+        try:
+            settings[name.strip()] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            settings[name.strip()] = value
+    return settings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='rebecca',
+                                     description='Analyze Biologic cycling data (.mpr files) in cell folders.')
+    parser.add_argument('folders', nargs='*', default=['.'],
+                        help='cell folders with .mpr file(s) (default: working directory)')
+    parser.add_argument('-s', '--set', action='append', metavar='NAME=VALUE', dest='settings',
+                        help='change a setting for this run; can be repeated (see --list-settings)')
+    parser.add_argument('-o', '--output', action='append', metavar='NAME', dest='outputs',
+                        help='make only this output; can be repeated (see --list-outputs)')
+    parser.add_argument('--list-settings', action='store_true', help='print all settings and their defaults')
+    parser.add_argument('--list-outputs', action='store_true',
+                        help='print all outputs, the stages they need and the settings they depend on')
+    args = parser.parse_args(argv)
+
+    from . import pipeline
+    if args.list_settings:
+        for name, value in pipeline.current_settings().items():
+            print('%-24s %r' % (name, value))
+        return 0
+    if args.list_outputs:
+        for name in pipeline.OUTPUTS:
+            stage = pipeline.STAGES[name]
+            print('%-18s from %s; settings: %s' % (name, ', '.join(stage.inputs), ', '.join(stage.settings) or '-'))
+        return 0
+    try:
+        settings = parse_settings(args.settings)
+    except argparse.ArgumentTypeError as error:
+        parser.error(str(error))
+    unknown = [name for name in settings if name not in pipeline.SETTINGS]
+    if unknown:
+        parser.error('unknown setting(s): ' + ', '.join(unknown) + '; see --list-settings')
+    unknown = [name for name in args.outputs or () if name not in pipeline.OUTPUTS]
+    if unknown:
+        parser.error('unknown output(s): ' + ', '.join(unknown) + '; see --list-outputs')
+    for folder in args.folders:
+        if len(args.folders) > 1:
+            print('\n' + folder)
+        pipeline.run(folder, outputs=args.outputs, **settings)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,36 @@
+"""
+Author: Venkatesh Krishnamurthy. Copyright 2022.
+
+Color helpers shared by pipeline.py and the scripts in python_pp/.
+"""
+
+import numpy as np
+
+
+def colorFader(c1,c2,mix=0):
+    """Function to interpolate between two chosen colors.
+    fade (linear interpolate) from color c1 (at mix=0) to c2 (mix=1)"""
+    import matplotlib as mpl
+    c1=np.array(mpl.colors.to_rgb(c1))
+    c2=np.array(mpl.colors.to_rgb(c2))
+    return mpl.colors.to_hex((1-mix)*c1 + mix*c2)
+
+
+def color_gradient(c1, c2, mix):
+    """
+    Function to interpolate between two colors for many mixing fractions at
+    once; vectorized colorFader. Colors are converted from strings only once.
+
+    Arguments:
+    c1 = color at mix=0, any matplotlib color e.g. 'red' or '#0069c0'
+    c2 = color at mix=1
+    mix = 1D array of mixing fractions, e.g. np.arange(n)/n for n lines
+
+    Returns:
+    Array of RGB colors with shape (len(mix), 3), usable as the colors of a
+    LineCollection or row by row as the color of a line
+    """
+    import matplotlib as mpl
+    c1 = np.array(mpl.colors.to_rgb(c1))
+    c2 = np.array(mpl.colors.to_rgb(c2))
+    return c1 + np.outer(mix, c2 - c1)
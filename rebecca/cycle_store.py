@@ -0,0 +1,341 @@
+"""
+Author: Venkatesh Krishnamurthy. Copyright 2022.
+
+Binary store of the charge/discharge profile, dQ/dV and dV/dQ of every half
+cycle of a cell. pipeline.py writes it to main_out/cycle_store/ instead of one
+csv file per half cycle in cycles/.
+
+The store is a folder of .npy files, one per column, with all half cycles
+concatenated:
+direction.npy           0 = charge, 1 = discharge, one entry per half cycle
+cycle.npy               cycle number of each half cycle
+<table>_offsets.npy     half cycle i is rows offsets[i]:offsets[i+1] of the
+                        columns of that table
+profile_capacity.npy, profile_voltage.npy   charge/discharge profile
+dQdV_voltage.npy, dQdV_dQdV.npy             filtered voltage and dQ/dV
+dVdQ_capacity.npy, dVdQ_dVdQ.npy            filtered capacity and dV/dQ
+summary.npy             per-cycle table of main_out/cycle_summary.csv as a
+                        structured array with the same column names
+
+Columns are memory-mapped when read and cycles are returned as views of
+them, so opening a store is instant and reading any list of cycles only
+touches their rows.
+
+Usage:
+python -m rebecca.cycle_store export [store] [folder]
+writes the same cycles/*.csv files as save_cycles_csv in pipeline.py; run it in
+the cell folder. Defaults are main_out/cycle_store and cycles.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+DIRECTIONS = ('charge', 'discharge')
+# Table name: column names; the table name is also the suffix of its csv files
+TABLES = {'profile': ('capacity', 'voltage'),
+          'dQdV': ('voltage', 'dQdV'),
+          'dVdQ': ('capacity', 'dVdQ')}
+
+
+class CycleStore:
+    """
+    Read-only access to a store written by write_store.
+
+    Argument:
+    path = store folder; defaults to the store of the cell in the working
+    directory
+
+    Example:
+    store = CycleStore()
+    q, v = store.read('discharge', 10)
+    v, dqdv = store.read('discharge', 10, 'dQdV')
+    for q, v in store.read_cycles('charge', [5, 10, 15]): ...
+    discharge_capacity = store.summary['discharge capacity/mA.h']
+    """
+
+    def __init__(self, path='main_out/cycle_store'):
+        self.path = path
+        self.direction = np.load(os.path.join(path, 'direction.npy'))
+        self.cycle = np.load(os.path.join(path, 'cycle.npy'))
+        self.offsets = {}
+        self.columns = {}
+        for table, columns in TABLES.items():
+            self.offsets[table] = np.load(os.path.join(path, table + '_offsets.npy'))
+            self.columns[table] = tuple(np.load(os.path.join(path, table + '_' + column + '.npy'), mmap_mode='r')
+                                        for column in columns)
+        self._position = {(DIRECTIONS[d], int(n)): i for i, (d, n) in enumerate(zip(self.direction, self.cycle))}
+        self.summary = None     # Per-cycle table, if the store has one
+        if os.path.exists(os.path.join(path, 'summary.npy')):
+            self.summary = np.load(os.path.join(path, 'summary.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.cycle)
+
+    def __contains__(self, key):
+        return key in self._position
+
+    def keys(self):
+        """List of (direction, cycle number) of all half cycles in the store."""
+        return list(self._position)
+
+    def cycles(self, direction):
+        """Array of the cycle numbers stored for 'charge' or 'discharge'."""
+        return self.cycle[self.direction == DIRECTIONS.index(direction)]
+
+    def rows(self, direction, cycle, table='profile'):
+        """
+        Function to find the rows of one half cycle in the columns of a table,
+        e.g. to pick it from an array computed for the whole store at once.
+
+        Arguments:
+        direction = 'charge' or 'discharge'
+        cycle = cycle number
+        table = 'profile', 'dQdV' or 'dVdQ'
+
+        Returns:
+        slice of the rows
+        """
+        try:
+            i = self._position[(direction, cycle)]
+        except KeyError:
+            raise KeyError('No %s %s in %s' % (direction, cycle, self.path)) from None
+        return slice(self.offsets[table][i], self.offsets[table][i+1])
+
+    def read(self, direction, cycle, table='profile'):
+        """
+        Function to read one half cycle.
+
+        Arguments:
+        direction = 'charge' or 'discharge'
+        cycle = cycle number
+        table = 'profile', 'dQdV' or 'dVdQ'
+
+        Returns:
+        Tuple of the table's columns (see TABLES) for that half cycle; the
+        arrays are read-only views of the memory-mapped store
+        """
+        rows = self.rows(direction, cycle, table)
+        return tuple(column[rows] for column in self.columns[table])
+
+    def read_cycles(self, direction, cycles, table='profile'):
+        """
+        Function to read a list of half cycles of one direction.
+
+        Arguments:
+        direction = 'charge' or 'discharge'
+        cycles = list of cycle numbers; None reads all stored cycles
+        table = 'profile', 'dQdV' or 'dVdQ'
+
+        Returns:
+        List with a tuple of views (see read) for each cycle, in order
+        """
+        if cycles is None:
+            cycles = self.cycles(direction)
+        return [self.read(direction, int(cycle), table) for cycle in cycles]
+
+    def matrix(self, direction, table='dQdV'):
+        """
+        Function to view a table of one direction as a (cycles x points)
+        matrix, for tables where every half cycle has the same number of
+        points, e.g. dQ/dV written with dqdv_method = 'histogram' in pipeline.py.
+
+        Arguments:
+        direction = 'charge' or 'discharge'
+        table = 'profile', 'dQdV' or 'dVdQ'
+
+        Returns:
+        cycles = array of cycle numbers, one per row
+        x = first column of the table for the first cycle, e.g. the voltage
+        bin centers
+        matrix = 2D read-only view of the second column, one row per cycle
+        (a copy if half cycles were appended to the store, see write_store)
+        """
+        select = np.flatnonzero(self.direction == DIRECTIONS.index(direction))
+        x, y = self.columns[table]
+        if len(select) == 0:
+            return self.cycle[select], x[:0], y[:0].reshape(0, 0)
+        offsets = self.offsets[table]
+        lengths = offsets[select + 1] - offsets[select]
+        if (lengths != lengths[0]).any():
+            raise ValueError('Half cycles of %s %s in %s have different lengths' % (direction, table, self.path))
+        start = offsets[select[0]]
+        if (np.diff(select) == 1).all():
+            # Half cycles of one direction are next to each other, in cycle order
+            return (self.cycle[select], x[start:start + lengths[0]],
+                    y[start:offsets[select[-1] + 1]].reshape(len(select), lengths[0]))
+        # Half cycles appended by incremental runs follow the others; copy them into one matrix
+        rows = (offsets[select][:, None] + np.arange(lengths[0])).ravel()
+        return self.cycle[select], x[start:start + lengths[0]], y[rows].reshape(len(select), lengths[0])
+
+
+def append_npy(filename, values):
+    """
+    Function to append values to a 1D .npy file in place: the values are
+    written at the end of the file, then the shape in the header is updated.
+    If the new shape does not fit in the header, the file is rewritten.
+
+    Arguments:
+    filename = .npy file of a 1D array
+    values = 1D numpy array, converted to the dtype of the file
+
+    Returns:
+    New length of the array
+    """
+    with open(filename, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            header_start = 10
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            header_start = 12
+        data_start = f.tell()
+        values = np.asarray(values, dtype=dtype)
+        n = shape[0] + len(values)
+        header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (np.lib.format.dtype_to_descr(dtype), n)
+        if len(shape) == 1 and len(header) < data_start - header_start:
+            f.seek(data_start + shape[0]*dtype.itemsize)
+            f.write(values.tobytes())
+            # The old header stays valid until the data is written
+            f.seek(header_start)
+            f.write((header.ljust(data_start - header_start - 1) + '\n').encode('latin1'))
+            return n
+    np.save(filename, np.concatenate((np.load(filename), values)))
+    return n
+
+
+def write_store(path, profiles, dqdv, dvdq, summary=None, append=False):
+    """
+    Function to write profiles, dQ/dV and dV/dQ of all half cycles to a store.
+    The store is written to a temporary folder next to path and then moved
+    into place, so readers never see a partly written store.
+
+    When appending half cycles that are not in the store yet, e.g. in
+    incremental mode, their rows and offsets are instead appended to the
+    .npy files in place (columns first, cycle numbers last), so the work
+    does not grow with the size of the store. They follow the half cycles
+    already stored rather than being sorted in with them.
+
+    Arguments:
+    path = store folder
+    profiles = dict returned by split_profiles in pipeline.py
+    dqdv = dict returned by compute_dQ_dV_data in pipeline.py
+    dvdq = dict returned by compute_dV_dQ_data in pipeline.py
+    summary = per-cycle table returned by summarize_cycles in pipeline.py; if
+    None, the summary already in the store is kept when appending
+    append = keep the half cycles already in the store at path; half cycles
+    given here replace stored ones with the same direction and cycle number
+
+    Returns:
+    Number of half cycles in the store
+    """
+    entries = {}
+    if summary is not None:
+        summary = summary.to_records(index=False)
+    if append and os.path.isfile(os.path.join(path, 'cycle.npy')):
+        stored = np.load(os.path.join(path, 'cycle.npy'))
+        stored = set(zip(np.load(os.path.join(path, 'direction.npy')).tolist(), stored.tolist()))
+        new = [(direction, cycle) for direction in DIRECTIONS for cycle in profiles.get(direction, {})]
+        if not any((DIRECTIONS.index(d), int(n)) in stored for d, n in new):
+            return _append_store(path, new, profiles, dqdv, dvdq, summary)
+    if append and os.path.isdir(path):
+        store = CycleStore(path)
+        for key in store.keys():
+            entries[key] = {table: store.read(key[0], key[1], table) for table in TABLES}
+        if summary is None:
+            summary = store.summary
+    for direction in profiles:
+        for cycle in profiles[direction]:
+            entries[(direction, cycle)] = {'profile': profiles[direction][cycle],
+                                           'dQdV': dqdv[direction][cycle],
+                                           'dVdQ': dvdq[direction][cycle]}
+    keys = sorted(entries, key=lambda key: (DIRECTIONS.index(key[0]), key[1]))
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.cycle_store.', suffix='.tmp', dir=parent)
+    np.save(os.path.join(tmp, 'direction.npy'), np.array([DIRECTIONS.index(d) for d, n in keys], dtype=np.int8))
+    np.save(os.path.join(tmp, 'cycle.npy'), np.array([n for d, n in keys], dtype=np.int64))
+    for table, columns in TABLES.items():
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(entries[key][table][0]) for key in keys])
+        np.save(os.path.join(tmp, table + '_offsets.npy'), offsets)
+        for j, column in enumerate(columns):
+            values = [np.asarray(entries[key][table][j], dtype=float) for key in keys]
+            np.save(os.path.join(tmp, table + '_' + column + '.npy'), np.concatenate(values) if values else np.zeros(0))
+    if summary is not None:
+        np.save(os.path.join(tmp, 'summary.npy'), np.asarray(summary))
+
+    # Drop views of the old store before replacing it
+    entries = store = summary = None
+    old = None
+    if os.path.isdir(path):
+        old = tmp + '.old'
+        os.rename(path, old)
+    os.rename(tmp, path)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+    return len(keys)
+
+
+def _append_store(path, keys, profiles, dqdv, dvdq, summary):
+    """Append the half cycles in keys to the store at path in place; see
+    write_store."""
+    curves = {'profile': profiles, 'dQdV': dqdv, 'dVdQ': dvdq}
+    for table, columns in TABLES.items():
+        for j, column in enumerate(columns):
+            values = [np.asarray(curves[table][d][n][j], dtype=float) for d, n in keys]
+            append_npy(os.path.join(path, table + '_' + column + '.npy'),
+                       np.concatenate(values) if values else np.zeros(0))
+    for table in TABLES:
+        filename = os.path.join(path, table + '_offsets.npy')
+        last = int(np.load(filename, mmap_mode='r')[-1])
+        append_npy(filename, last + np.cumsum([len(curves[table][d][n][0]) for d, n in keys]))
+    if summary is not None:
+        np.save(os.path.join(path, 'summary.npy'), np.asarray(summary))
+    append_npy(os.path.join(path, 'direction.npy'), [DIRECTIONS.index(d) for d, n in keys])
+    return append_npy(os.path.join(path, 'cycle.npy'), [n for d, n in keys])
+
+
+def export_csv(path='main_out/cycle_store', folder='cycles'):
+    """
+    Function to write every half cycle in a store to csv files in folder:
+    *_i.csv (columns: charge, voltage), *_i_dQdV.csv (columns: voltage,
+    dQ/dV) and *_i_dVdQ.csv (columns: charge, dV/dQ), where * = 'charge' or
+    'discharge' and i is the cycle number. Same files as save_cycles_data in
+    pipeline.py.
+
+    Arguments:
+    path = store folder
+    folder = output folder
+
+    Returns:
+    Number of half cycles exported
+    """
+    store = CycleStore(path)
+    os.makedirs(folder, exist_ok=True)
+    for direction, cycle in store.keys():
+        filename = os.path.join(folder, direction + '_' + str(cycle))
+        for table in TABLES:
+            suffix = '' if table == 'profile' else '_' + table
+            np.savetxt(filename + suffix + '.csv', np.column_stack(store.read(direction, cycle, table)), delimiter=',')
+    return len(store)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Binary store of the per-cycle data of a cell.')
+    commands = parser.add_subparsers(dest='command')
+    export = commands.add_parser('export', help='write the store to cycles/*.csv files')
+    export.add_argument('store', nargs='?', default='main_out/cycle_store', help='store folder (default: main_out/cycle_store)')
+    export.add_argument('folder', nargs='?', default='cycles', help='output folder (default: cycles)')
+    args = parser.parse_args()
+    if args.command == 'export':
+        n = export_csv(args.store, args.folder)
+        print('Exported %d half cycles from %s to %s/' % (n, args.store, args.folder))
+    else:
+        parser.print_help()
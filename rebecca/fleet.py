@@ -0,0 +1,304 @@
+"""
+Author: Venkatesh Krishnamurthy. Copyright 2022.
+
+Compares many cells at once. Loads the per-cycle summary of every cell
+folder inside a root folder (written by pipeline.py) into one table and computes
+capacity retention, cycles to a retention threshold and Coulombic efficiency
+percentile bands across all cells.
+
+A cell folder is any subfolder of the root folder with main_out/ in it, i.e.
+the folders processed by batch.py. The summary is read from
+main_out/cycle_store/summary.npy if it exists, else from
+main_out/cycle_summary.csv. Folders are read in parallel threads.
+
+Usage:
+python -m rebecca.fleet root_folder [--workers N] [--out folder]
+                                 [--threshold 80] [--reference-cycle 1]
+writes to root_folder/fleet_out/ (or --out):
+fleet_summary.csv       all cells' per-cycle tables with cell and retention
+                        columns added
+cycles_to_80.csv        first cycle with discharge capacity retention below
+                        the threshold, per cell; empty if never reached
+ce_bands.csv            percentiles of Coulombic efficiency across cells,
+                        per cycle
+retention.png, ce_bands.png     overlay plots
+
+Example, from Python:
+fleet = load_fleet(find_cells('data'))
+fleet['retention/%'] = retention(fleet)
+fleet.loc['cell_07']        # Per-cycle table of one cell
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+def find_cells(root):
+    """
+    Function to find cell folders, i.e. subfolders with a main_out/ folder.
+
+    Argument:
+    root = path of the folder containing the cell folders
+
+    Returns:
+    Sorted list of paths of cell folders
+    """
+    folders = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if os.path.isdir(os.path.join(path, 'main_out')):
+            folders.append(path)
+    return folders
+
+
+def read_summary(folder):
+    """
+    Function to read the per-cycle summary of one cell.
+
+    Argument:
+    folder = path of the cell folder
+
+    Returns:
+    dict of column name: numpy array, with the columns of
+    main_out/cycle_summary.csv, or None if the cell has no summary
+    """
+    store_summary = os.path.join(folder, 'main_out', 'cycle_store', 'summary.npy')
+    if os.path.exists(store_summary):
+        summary = np.load(store_summary)
+        return {name: summary[name] for name in summary.dtype.names}
+    if os.path.exists(os.path.join(folder, 'main_out', 'cycle_summary.csv')):
+        summary = pd.read_csv(os.path.join(folder, 'main_out', 'cycle_summary.csv'))
+        return {name: summary[name].to_numpy() for name in summary.columns}
+    return None
+
+
+def load_fleet(folders, workers=None):
+    """
+    Function to read the per-cycle summaries of many cells in parallel into
+    one table. The columns of all cells are joined with one copy each; only
+    columns present in every cell are kept. Cells without a summary are
+    skipped.
+
+    Arguments:
+    folders = list of paths of cell folders, e.g. returned by find_cells
+    workers = number of threads; defaults to a number based on the CPUs
+
+    Returns:
+    pandas dataframe indexed by (cell, cycle), where cell is the name of the
+    cell folder, with the per-cycle columns of all cells
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        summaries = list(pool.map(read_summary, folders))
+    names, tables = [], []
+    for folder, summary in zip(folders, summaries):
+        if summary is None:
+            print('Skipping ' + folder + ' because it has no cycle summary...')
+            continue
+        names.append(os.path.basename(os.path.normpath(folder)))
+        tables.append(summary)
+    if not tables:
+        return pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=['cell', 'cycle']))
+
+    columns = [name for name in tables[0] if all(name in table for table in tables)]
+    lengths = [len(table['cycle']) for table in tables]
+    index = pd.MultiIndex.from_arrays([pd.Categorical.from_codes(np.repeat(np.arange(len(names)), lengths), names),
+                                       np.concatenate([table['cycle'] for table in tables])],
+                                      names=['cell', 'cycle'])
+    return pd.DataFrame({name: np.concatenate([table[name] for table in tables])
+                         for name in columns if name != 'cycle'}, index=index)
+
+
+def retention(fleet, column='discharge capacity/mA.h', reference_cycle=1):
+    """
+    Function to compute capacity retention of every cell in percent of the
+    value at its reference cycle.
+
+    Arguments:
+    fleet = table returned by load_fleet
+    column = capacity column
+    reference_cycle = cycle used as 100%; if a cell has no value there, its
+    first value after it is used
+
+    Returns:
+    pandas series indexed like fleet
+    """
+    values = fleet[column]
+    valid = values.notna().to_numpy() & (fleet.index.get_level_values('cycle') >= reference_cycle)
+    reference = values[valid].groupby(level='cell', sort=False).first()
+    reference = reference.reindex(fleet.index.get_level_values('cell')).to_numpy()
+    return (100*values/reference).rename('retention/%')
+
+
+def cycles_to_threshold(fleet, threshold=80, column='discharge capacity/mA.h', reference_cycle=1):
+    """
+    Function to find, for every cell, the first cycle at which capacity
+    retention is below threshold.
+
+    Arguments:
+    fleet = table returned by load_fleet
+    threshold = retention in percent
+    column, reference_cycle = see retention
+
+    Returns:
+    pandas series indexed by cell; NaN for cells that never dropped below
+    threshold
+    """
+    below = (retention(fleet, column, reference_cycle) < threshold).to_numpy()
+    cycles = pd.Series(fleet.index.get_level_values('cycle'), index=fleet.index.get_level_values('cell'))
+    cells = fleet.index.get_level_values('cell').unique()
+    first = cycles[below].groupby(level=0, sort=False).min()
+    return first.reindex(cells).rename('cycles to %g%%' % threshold)
+
+
+def percentile_bands(fleet, column='coulombic efficiency/%', percentiles=(5, 25, 50, 75, 95)):
+    """
+    Function to compute percentiles of a column across all cells, for every
+    cycle.
+
+    Arguments:
+    fleet = table returned by load_fleet
+    column = per-cycle column
+    percentiles = list of percentiles
+
+    Returns:
+    pandas dataframe indexed by cycle, with the number of cells that have a
+    value ('cells') and one column per percentile, e.g. '50%'
+    """
+    wide = fleet[column].unstack(level='cell')
+    wide = wide[wide.notna().any(axis=1)]
+    bands = pd.DataFrame(index=wide.index)
+    bands['cells'] = wide.notna().sum(axis=1)
+    values = np.nanpercentile(wide.to_numpy(dtype=float), percentiles, axis=1)
+    for p, value in zip(percentiles, values):
+        bands['%g%%' % p] = value
+    return bands
+
+
+def plot_overlay(series, ylabel, plot_name, title=None):
+    """
+    Plots one line per cell vs cycle number, all cells as one LineCollection.
+
+    Arguments:
+    series = pandas series indexed by (cell, cycle), e.g. from retention
+    ylabel = y axis label
+    plot_name = path of the saved figure
+    title = figure title
+
+    Returns:
+    None
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+    series = series.dropna()
+    cells = series.index.get_level_values('cell')
+    cycles = series.index.get_level_values('cycle').to_numpy(dtype=float)
+    points = np.column_stack([cycles, series.to_numpy(dtype=float)])
+    starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]]) if len(series) else np.zeros(0, dtype=int)
+    segments = np.split(points, starts[1:])
+    colors = plt.get_cmap('viridis')(np.linspace(0, 1, max(len(segments), 1)))
+
+    fig, ax = plt.subplots()
+    ax.add_collection(LineCollection(segments, colors=colors[:len(segments)], linewidths=1))
+    if 0 < len(segments) <= 10:
+        for name, color in zip(cells[starts], colors):
+            ax.plot([], [], color=color, label=name)
+        ax.legend(fontsize='x-small')
+    ax.autoscale()
+    ax.set_title(title or ylabel + ' of %d cells' % len(segments))
+    ax.set_xlabel('Cycle number')
+    ax.set_ylabel(ylabel)
+    fig.savefig(plot_name, bbox_inches='tight', dpi=200)
+    plt.close(fig)
+    return None
+
+
+def plot_bands(bands, ylabel, plot_name):
+    """
+    Plots the median and percentile bands returned by percentile_bands; the
+    outer and inner pair of percentiles are shaded.
+
+    Arguments:
+    bands = table returned by percentile_bands
+    ylabel = y axis label
+    plot_name = path of the saved figure
+
+    Returns:
+    None
+    """
+    import matplotlib.pyplot as plt
+    columns = [name for name in bands.columns if name != 'cells']
+    cycles = bands.index.to_numpy()
+    fig, ax = plt.subplots()
+    for i in range(len(columns)//2):
+        low, high = columns[i], columns[-1 - i]
+        ax.fill_between(cycles, bands[low], bands[high], color='#0069c0', alpha=0.2 + 0.2*i, linewidth=0,
+                        label=low + ' to ' + high)
+    if len(columns) % 2:
+        ax.plot(cycles, bands[columns[len(columns)//2]], color='#0069c0', label=columns[len(columns)//2])
+    ax.set_title(ylabel + ' across cells')
+    ax.set_xlabel('Cycle number')
+    ax.set_ylabel(ylabel)
+    ax.legend(fontsize='x-small')
+    fig.savefig(plot_name, bbox_inches='tight', dpi=200)
+    plt.close(fig)
+    return None
+
+
+def run_fleet(root, out=None, workers=None, threshold=80, reference_cycle=1):
+    """
+    Function to load all cells inside root and write the fleet tables and
+    plots listed at the top of this file.
+
+    Arguments:
+    root = path of the folder containing the cell folders
+    out = output folder; defaults to root/fleet_out
+    workers = number of threads used to read the cells
+    threshold = retention threshold in percent for cycles to threshold
+    reference_cycle = cycle used as 100% retention
+
+    Returns:
+    fleet = table returned by load_fleet, with a 'retention/%' column
+    """
+    start = time.perf_counter()
+    out = out or os.path.join(root, 'fleet_out')
+    os.makedirs(out, exist_ok=True)
+    fleet = load_fleet(find_cells(root), workers)
+    cells = fleet.index.get_level_values('cell').unique()
+    print('Loaded %d cycles of %d cells in %.2f s.' % (len(fleet), len(cells), time.perf_counter() - start))
+    if len(fleet) == 0:
+        return fleet
+
+    fleet['retention/%'] = retention(fleet, reference_cycle=reference_cycle)
+    fleet.to_csv(os.path.join(out, 'fleet_summary.csv'))
+    cycles_to_threshold(fleet, threshold, reference_cycle=reference_cycle).to_csv(
+        os.path.join(out, 'cycles_to_%g.csv' % threshold))
+    bands = percentile_bands(fleet)
+    bands.to_csv(os.path.join(out, 'ce_bands.csv'))
+    plot_overlay(fleet['retention/%'], 'Discharge capacity retention (%)', os.path.join(out, 'retention.png'))
+    plot_bands(bands, 'Coulombic efficiency (%)', os.path.join(out, 'ce_bands.png'))
+    print('Saved fleet tables and plots to %s in %.2f s.' % (out, time.perf_counter() - start))
+    return fleet
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='rebecca-fleet', description='Compare the per-cycle summaries of all cell folders inside a root folder.')
+    parser.add_argument('root', help='folder containing one subfolder per cell')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of threads reading the cells (default: based on the number of CPUs)')
+    parser.add_argument('-o', '--out', default=None, help='output folder (default: root/fleet_out)')
+    parser.add_argument('--threshold', type=float, default=80,
+                        help='retention threshold in percent for cycles_to_*.csv (default: 80)')
+    parser.add_argument('--reference-cycle', type=int, default=1,
+                        help='cycle used as 100%% capacity retention (default: 1)')
+    args = parser.parse_args(argv)
+    run_fleet(args.root, args.out, args.workers, args.threshold, args.reference_cycle)
+    return 0
+
+
+if __name__ == '__main__':
+    main()
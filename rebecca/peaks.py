@@ -0,0 +1,100 @@
+"""
+Author: Venkatesh Krishnamurthy. Copyright 2022.
+
+Peak finding in dQ/dV curves, batched over all cycles of a cell.
+
+Curves are passed the same way as to smoothing.py: the x and y values of all
+cycles concatenated into two flat arrays, plus offsets so that cycle i is
+rows offsets[i]:offsets[i+1]. A peak is a point that is higher than the
+point before it and not lower than the point after it in the same cycle;
+plateaus count once, at their first point. The highest n_peaks peaks of each
+cycle are kept. Their width is measured at half their height, with the
+crossings linearly interpolated in x, the same way as the 'rel_height=0.5'
+width of scipy.signal.peak_widths but from zero instead of from the base of
+the peak. All cycles are handled in one pass, so the time grows linearly
+with the number of points.
+"""
+
+import numpy as np
+
+
+def _half_height_crossing(x, y, peaks, half, starts, stops, step):
+    """Interpolated x where y first drops below half, walking from each peak
+    in the direction of step (-1 or 1); the end point of the cycle if y stays
+    above half."""
+    position = peaks.copy()
+    edge = starts if step < 0 else stops - 1
+    walking = np.flatnonzero(position != edge)
+    while len(walking) > 0:
+        position[walking] += step
+        moved = position[walking]
+        walking = walking[(y[moved] >= half[walking]) & (moved != edge[walking])]
+    crossed = y[position] < half
+    # Interpolate between the last point above half and the first point below
+    inside = position - step
+    inside[~crossed] = position[~crossed]
+    y_in, y_out = y[inside], y[position]
+    fraction = np.where(crossed, (y_in - half)/np.where(crossed, y_in - y_out, 1), 0)
+    return x[inside] + fraction*(x[position] - x[inside])
+
+
+def find_peaks(x, y, offsets=None, n_peaks=3):
+    """
+    Function to find the highest peaks of every cycle in one call.
+
+    Arguments:
+    x, y = 1D numpy arrays of all cycles concatenated, e.g. the voltage and
+    dQ/dV columns of a cycle store; for discharge dQ/dV, pass -y to find
+    its (negative) peaks
+    offsets = cycle i is rows offsets[i]:offsets[i+1]; None if one cycle
+    n_peaks = max number of peaks kept per cycle
+
+    Returns:
+    cycle = index of the cycle in offsets of each peak
+    rank = 1 for the highest peak of its cycle, 2 for the next, ...
+    position = x of each peak
+    height = y of each peak
+    width = width in x at half height
+    Peaks are sorted by cycle, then by rank.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if offsets is None:
+        offsets = [0, len(y)]
+    offsets = np.asarray(offsets)
+
+    # Local maxima; the first and last point of a cycle are never peaks
+    finite = np.isfinite(x) & np.isfinite(y)
+    is_peak = np.zeros(len(y), dtype=bool)
+    is_peak[1:-1] = (finite[1:-1] & finite[:-2] & finite[2:] & (y[1:-1] > y[:-2]) & (y[1:-1] >= y[2:]))
+    is_peak[offsets[:-1][offsets[:-1] < len(y)]] = False
+    is_peak[offsets[1:][offsets[1:] > 0] - 1] = False
+    peaks = np.flatnonzero(is_peak)
+    row = np.searchsorted(offsets, peaks, side='right') - 1
+
+    # Keep the n_peaks highest of each cycle: take the highest remaining
+    # peak of every cycle n_peaks times instead of sorting all peaks
+    selected, ranks = [], []
+    if len(peaks) > 0:
+        first = np.flatnonzero(np.r_[True, row[1:] != row[:-1]])
+        segment = np.repeat(np.arange(len(first)), np.diff(np.r_[first, len(peaks)]))
+        remaining = y[peaks]
+        for rank in range(1, n_peaks + 1):
+            top = np.maximum.reduceat(remaining, first)
+            hits = np.where((remaining == top[segment]) & (remaining > -np.inf), np.arange(len(peaks)), len(peaks))
+            pick = np.minimum.reduceat(hits, first)
+            pick = pick[pick < len(peaks)]
+            remaining[pick] = -np.inf
+            selected.append(pick)
+            ranks.append(np.full(len(pick), rank))
+    selected = np.concatenate(selected) if selected else np.zeros(0, dtype=int)
+    rank = np.concatenate(ranks) if ranks else np.zeros(0, dtype=int)
+    order = np.argsort(row[selected]*(n_peaks + 1) + rank, kind='stable')
+    peaks, row, rank = peaks[selected[order]], row[selected[order]], rank[order]
+
+    # Stop the walks at non-finite points by treating them as below half
+    half = y[peaks]/2
+    y_walk = np.where(finite, y, -np.inf)
+    left = _half_height_crossing(x, y_walk, peaks, half, offsets[row], offsets[row + 1], -1)
+    right = _half_height_crossing(x, y_walk, peaks, half, offsets[row], offsets[row + 1], 1)
+    return row, rank, x[peaks], y[peaks], np.abs(right - left)
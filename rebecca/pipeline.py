@@ -0,0 +1,2213 @@
+"""
+Author: Venkatesh Krishnamurthy. Copyright 2022. 
+Minor contributions by Chris Eschler.
+
+The analysis of one cell: reads the .mpr file(s) in a folder, and saves
+plots, per-cycle tables, the cycle store, dQ/dV and dV/dQ to main_out/ etc.
+in that folder. The settings below are the defaults; pass any of them to
+run(), e.g. run('path/to/cell', save_to_video=True), or on the command line
+with 'rebecca path/to/cell --set save_to_video=True'.
+
+galvani, matplotlib and cv2 are imported by the functions that use them, so
+that importing this module is fast and runs without plots or videos do not
+load them.
+"""
+
+import pandas as pd
+import numpy as np
+import cProfile
+import contextlib
+import gc
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from time import perf_counter, process_time
+from . import __version__
+from .colors import color_gradient
+from .cycle_store import write_store
+from .peaks import find_peaks
+from .smoothing import smooth
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:     # Python < 3.8; arrays are pickled instead
+    shared_memory = None
+try:
+    import resource
+except ImportError:     # Windows; peak memory is not reported
+    resource = None
+
+
+###############################################################################
+# Important variables
+###############################################################################
+_names_before_settings = set(globals())
+
+same_xlim_every_cycle = True     # Uses same xlim i.e. capacity for all cycles
+voltage_limits = [1.5, 4.8]      # Voltage limits for all plots
+remove_OCV_part = True           # Removes OCV part for plot of each cycle; not removed for time series plots
+stitch_files = True              # Stitches together multiple files into one dataframe; use when multiple files are part of one test
+stitch_workers = None            # Threads used to read files to be stitched; None uses the number of CPUs
+load_columns = ['flags', 'Ns', 'time/s', 'Ewe/V', 'Q charge/discharge/mA.h', '(Q-Qo)/mA.h',
+                'control/V/mA', 'dQ/mA.h', 'half cycle']    # Columns kept after reading; None keeps all
+compact_dtypes = True            # Store voltages as float32 and integer columns in the smallest type that fits
+dqdv_tol = 0.001                 # Absolute tolerance for dQ/dV
+dqdv_method = 'difference'       # 'difference': forward difference of points dqdv_tol apart; 'histogram': capacity per bin of a common voltage grid
+dqdv_bins = 500                  # Number of voltage bins between voltage_limits for 'histogram' dQ/dV
+dvdq_scheme = 'central'          # Finite difference for dV/dQ: 'forward', 'backward' or 'central'
+smooth_method = None             # Smooth saved dQ/dV and dV/dQ: None, 'rolling', 'savitzky_golay', 'gaussian' or 'lowess'
+smooth_window = 11               # Number of points in the smoothing window
+smooth_order = 2                 # Order of the Savitzky-Golay polynomial
+track_peaks = True               # Save the highest dQ/dV peaks of every half cycle to main_out/dqdv_peaks.csv and plot them
+n_peaks = 3                      # Number of dQ/dV peaks kept per half cycle
+save_cycle_store = True          # Save all charge/discharge profiles and their dQ/dV, dV/dQ to main_out/cycle_store/
+save_cycles_csv = False          # Also save each profile and its dQ/dV, dV/dQ to cycles/*.csv; or run 'python -m rebecca.cycle_store export'
+use_cache = True                 # Cache parsed .mpr data as .npy columns; reloaded with memory-mapping
+cache_dir = None                 # Folder for the cache; None uses .rebecca_cache/ next to the .mpr file(s)
+cache_max_size = 5*1024**3       # Max total size of the cache in bytes; least recently used files are removed
+incremental = False              # Only process half cycles completed since the last run; use while the test is running
+stage_cache = True               # Keep stage results in main_out/stage_cache/; only re-run stages whose inputs or settings changed
+
+
+color1 = 'red'
+color2 = 'black'
+color_ch = '#0069c0'
+color_disch = '#0069c0'
+color_CE = '#0069c0'
+CE_100pc_line = True    # Add line at 100% Coulombic efficiency
+CE_ylim = None          # Y limits of the CE plot, e.g. [1, 101]; None uses default limits and adds the 100% line
+
+# Note: If plot_all_cycles is false, save_to_video variable is ignored
+save_to_video = False   # Save each charge/discharge cycle video or not
+plot_all_cycles = False # Save each charge/discharge profile or not
+fps = 24                # Frames per second for video
+decimate_plots = True   # Only draw first, last, min and max point per pixel column in time series and voltage vs capacity plots
+render_workers = None   # Processes used to render figures; None uses the number of CPUs, 1 renders in this process
+stage_report = True     # Save wall time, CPU time, peak memory and rows processed of each stage to main_out/stage_report.json
+profile_stages = False  # Also save a cProfile dump of each stage to main_out/stage_profiles/<stage>.prof
+
+# Other colors
+# color = '#0047ab' # Cobalt blue
+# color = '#0b1d78' # Dark blue
+# color = '#332288' # Dark purple
+# color = '#0b1d78' # Dark blue
+# color = '#808080' # Gray
+# color = '#6b6b6b' # Dark gray
+
+# Names of all settings above, in order; run() takes any of them as keyword arguments
+SETTINGS = tuple(name for name in globals() if name not in _names_before_settings | {'_names_before_settings'})
+del _names_before_settings
+
+###############################################################################
+# Function definitions
+###############################################################################
+
+# Helper functions- called by functions but not main
+def build_half_cycle_index(data):
+    """Function to find where each half cycle starts and stops in the data.
+    Built once after loading so that every stage slices contiguous arrays
+    instead of regrouping the dataframe.
+
+    Argument:
+    data = pandas dataframe object
+
+    Returns:
+    index = pandas dataframe with one row per half cycle, in order, and columns
+        'half cycle': half cycle number from the .mpr file
+        'start', 'stop': row offsets of the half cycle (stop is exclusive)
+        'discharge': True if discharging, False if charging or no current
+        'cycle': charge or discharge cycle number, starting from 1
+        'capacity': max charge or discharge capacity (mAh), positive
+    """
+    half_cycle = data['half cycle'].to_numpy()
+    q = data['Q charge/discharge/mA.h'].to_numpy()
+    boundaries = np.flatnonzero(np.diff(half_cycle) != 0) + 1
+    if len(half_cycle) > 0:
+        starts = np.concatenate(([0], boundaries))
+        stops = np.concatenate((boundaries, [len(half_cycle)]))
+    else:
+        starts = stops = boundaries
+
+    # Checks for total charge passed in that half cycle.
+    # If negative, it is discharging
+    discharge = q[stops - 1] < 0
+    cycle = np.where(discharge, np.cumsum(discharge), np.cumsum(~discharge))
+    sign = np.repeat(np.where(discharge, -1, 1), stops - starts)
+    capacity = np.maximum.reduceat(sign*q, starts) if len(starts) > 0 else np.zeros(0)
+
+    return pd.DataFrame({'half cycle': half_cycle[starts], 'start': starts, 'stop': stops,
+                         'discharge': discharge, 'cycle': cycle, 'capacity': capacity})
+
+
+def next_outside_tolerance(v, tol):
+    """Function to find, for every point, the next point whose voltage differs
+    from it by at least tol.
+
+    Uses sparse tables of running max/min over windows of length 2**k and
+    binary lifting, so the whole array is processed in O(n log n) numpy
+    operations instead of a Python loop.
+
+    Arguments:
+    v = 1D numpy array of voltages
+    tol = absolute voltage tolerance
+
+    Returns:
+    nxt = integer array; nxt[i] is the smallest j > i with
+    abs(v[j] - v[i]) >= tol, or len(v) if there is no such point
+    """
+    n = len(v)
+    maxs = [v]
+    mins = [v]
+    while (1 << len(maxs)) <= n:
+        half = 1 << (len(maxs) - 1)
+        maxs.append(np.maximum(maxs[-1][:-half], maxs[-1][half:]))
+        mins.append(np.minimum(mins[-1][:-half], mins[-1][half:]))
+
+    # Extend the window [i+1, nxt[i]) while it stays within tol of v[i].
+    # Rounding is monotonic, so comparing against the window max/min gives
+    # exactly the same result as comparing every point in the window.
+    nxt = np.arange(1, n + 1)
+    for k in reversed(range(len(maxs))):
+        width = 1 << k
+        idx = np.flatnonzero(nxt + width <= n)
+        start = nxt[idx]
+        inside = ((maxs[k][start] - v[idx] < tol)
+                  & (v[idx] - mins[k][start] < tol))
+        nxt[idx[inside]] += width
+    return nxt
+
+
+def dqdv_filter_indices(v, tol):
+    """Function to select the points used for dQ/dV.
+    Keeps the first point, then every point whose voltage differs from the
+    previously kept point by at least tol.
+
+    Arguments:
+    v = 1D numpy array of voltages
+    tol = absolute voltage tolerance
+
+    Returns:
+    Sorted integer array of indices of the points to keep
+    """
+    n = len(v)
+    if n == 0:
+        return np.zeros(0, dtype=int)
+
+    # Kept points are the chain 0 -> nxt[0] -> nxt[nxt[0]] -> ...
+    # Mark the chain with pointer doubling; n is a sentinel mapping to itself.
+    jump = np.append(next_outside_tolerance(v, tol), n)
+    on_chain = np.zeros(n + 1, dtype=bool)
+    on_chain[0] = True
+    while jump[0] != n:
+        on_chain[jump[on_chain]] = True
+        jump = jump[jump]
+    return np.flatnonzero(on_chain[:n])
+
+
+def compute_dqdv(q, v, tol):
+    """Function to compute dQ/dV for one charge or discharge profile.
+    Filters out points within tol of the previously kept voltage, then uses
+    forward difference; sets 1st and last point to 0.
+
+    Arguments:
+    q = 1D numpy array of capacities
+    v = 1D numpy array of voltages
+    tol = absolute voltage tolerance
+
+    Returns:
+    v, dqdv = 1D numpy arrays of filtered voltages and dQ/dV
+    """
+    keep = dqdv_filter_indices(v, tol)
+    q = q[keep]
+    v = v[keep]
+    dqdv = np.zeros(len(v))
+    dqdv[1:-1] = (q[2:] - q[1:-1])/(v[2:] - v[1:-1])
+    return v, dqdv
+
+
+def compute_dvdq(q, v, scheme='central'):
+    """Function to compute dV/dQ for one charge or discharge profile.
+    Drops points with the same charge as the previous point, then uses the
+    chosen finite difference. Centered difference uses forward and backward
+    difference for the 1st and last point; forward (backward) difference
+    uses backward (forward) difference for the last (1st) point.
+
+    Arguments:
+    q = 1D numpy array of capacities
+    v = 1D numpy array of voltages
+    scheme = 'forward', 'backward' or 'central'
+
+    Returns:
+    q, dvdq = 1D numpy arrays of filtered capacities and dV/dQ
+    """
+    if scheme not in ('forward', 'backward', 'central'):
+        raise ValueError("dV/dQ scheme must be 'forward', 'backward' or 'central', not " + repr(scheme))
+
+    # Remove point if charge is the same as previous
+    keep = np.ones(len(q), dtype=bool)
+    keep[1:] = q[1:] != q[:-1]
+    q = q[keep]
+    v = v[keep]
+    if len(q) < 2:
+        return q, np.full(len(q), np.nan)
+
+    dvdq = np.empty(len(q))
+    dvdq[0] = (v[1]-v[0])/(q[1]-q[0])
+    dvdq[-1] = (v[-1]-v[-2])/(q[-1]-q[-2])
+    if scheme == 'central':
+        dvdq[1:-1] = (v[2:] - v[:-2])/(q[2:] - q[:-2])
+    elif scheme == 'forward':
+        dvdq[:-1] = (v[1:] - v[:-1])/(q[1:] - q[:-1])
+    else:
+        dvdq[1:] = (v[1:] - v[:-1])/(q[1:] - q[:-1])
+    return q, dvdq
+
+
+def dqdv_histogram(profiles, edges, sign=1):
+    """Function to compute dQ/dV of many profiles on a common voltage grid in
+    one pass. The capacity change of each step between two points is added
+    to the voltage bin of the step's mean voltage and divided by the bin
+    width, so every profile gives one row of the same length.
+
+    Arguments:
+    profiles = dict of cycle: (capacity, voltage), e.g. profiles['charge']
+    edges = 1D numpy array of voltage bin edges
+    sign = -1 for discharge profiles, so that dQ/dV has the same sign as
+    with compute_dqdv
+
+    Returns:
+    cycles = array of cycle numbers
+    matrix = 2D numpy array (cycles x bins) of dQ/dV
+    """
+    cycles, q, v, offsets = pack_profiles(profiles)
+    n_bins = len(edges) - 1
+    row = np.repeat(np.arange(len(cycles)), np.diff(offsets))
+    bins = np.searchsorted(edges, (v[1:] + v[:-1])/2, side='right') - 1
+    # Skip steps from the last point of one profile to the first of the next
+    keep = (row[1:] == row[:-1]) & (bins >= 0) & (bins < n_bins)
+    matrix = np.bincount(row[1:][keep]*n_bins + bins[keep], weights=np.diff(q)[keep],
+                         minlength=len(cycles)*n_bins).reshape(len(cycles), n_bins)
+    return cycles, sign*matrix/np.diff(edges)
+
+
+def file_hash(filename):
+    """Function to compute the BLAKE2 hash of the contents of a file.
+
+    Argument:
+    filename = path of the file
+
+    Returns:
+    Hex digest string
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(8*1024*1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def evict_cache(cache_root, max_size):
+    """Function to remove least recently used cache entries until the total
+    size of the cache is at most max_size bytes.
+
+    Arguments:
+    cache_root = cache folder
+    max_size = max total size in bytes
+
+    Returns:
+    None
+    """
+    entries = []
+    for name in os.listdir(cache_root):
+        path = os.path.join(cache_root, name)
+        if not os.path.isdir(path) or '.tmp' in name:
+            continue
+        try:
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            entries.append((os.stat(path).st_mtime, size, path))
+        except OSError:
+            continue    # Removed by another process or thread
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+    return None
+
+
+def read_mpr(filename):
+    """Function to read an .mpr file into a dataframe, using the cache if
+    use_cache is True.
+
+    Cache entries are folders named by the hash of the .mpr file contents,
+    holding one .npy file per column. cache_root/index.json maps each .mpr
+    path to its size, mtime and hash so that unchanged files are not hashed
+    again. Entries are loaded with memory-mapping.
+
+    Argument:
+    filename = path of the .mpr file
+
+    Returns:
+    data = pandas dataframe object
+    """
+    from galvani import BioLogic
+    if not use_cache:
+        return pd.DataFrame(BioLogic.MPRfile(filename).data)
+
+    path = os.path.abspath(filename)
+    cache_root = cache_dir or os.path.join(os.path.dirname(path), '.rebecca_cache')
+    os.makedirs(cache_root, exist_ok=True)
+    index_file = os.path.join(cache_root, 'index.json')
+    try:
+        with open(index_file) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+
+    # Only hash the file if its size or mtime changed since last time
+    stat = os.stat(path)
+    key = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    if {k: index.get(path, {}).get(k) for k in key} == key:
+        digest = index[path]['hash']
+    else:
+        digest = file_hash(path)
+        index[path] = dict(key, hash=digest)
+        fd, tmp_file = tempfile.mkstemp(dir=cache_root, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_file, index_file)
+
+    entry = os.path.join(cache_root, digest)
+    if os.path.isfile(os.path.join(entry, 'columns.json')):
+        with open(os.path.join(entry, 'columns.json')) as f:
+            columns = json.load(f)
+        data = pd.DataFrame({name: np.load(os.path.join(entry, str(i) + '.npy'), mmap_mode='c')
+                             for i, name in enumerate(columns)}, copy=False)
+        os.utime(entry)     # Mark as recently used
+        return data
+
+    data = pd.DataFrame(BioLogic.MPRfile(path).data)
+
+    # Write to a temporary folder, then rename, so that other processes
+    # never see a partly written entry
+    tmp_entry = tempfile.mkdtemp(dir=cache_root, prefix=digest + '.tmp')
+    for i, name in enumerate(data.columns):
+        np.save(os.path.join(tmp_entry, str(i) + '.npy'), data[name].to_numpy())
+    with open(os.path.join(tmp_entry, 'columns.json'), 'w') as f:
+        json.dump(list(data.columns), f)
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        shutil.rmtree(tmp_entry, ignore_errors=True)   # Written by another process or thread
+    evict_cache(cache_root, cache_max_size)
+    return data
+
+
+def current_settings():
+    """Values of all SETTINGS as used by the current run."""
+    return {name: globals()[name] for name in SETTINGS}
+
+
+def incremental_settings():
+    """Settings that change the per-cycle outputs; a change means that
+    incremental processing has to start again from the first half cycle."""
+    return {'stitch_files': stitch_files, 'remove_OCV_part': remove_OCV_part,
+            'dqdv_tol': dqdv_tol, 'dqdv_method': dqdv_method, 'dqdv_bins': dqdv_bins, 'dvdq_scheme': dvdq_scheme,
+            'smooth_method': smooth_method, 'smooth_window': smooth_window, 'smooth_order': smooth_order,
+            'track_peaks': track_peaks, 'n_peaks': n_peaks,
+            'voltage_limits': list(voltage_limits), 'same_xlim_every_cycle': same_xlim_every_cycle,
+            'plot_all_cycles': plot_all_cycles, 'save_cycles_csv': save_cycles_csv,
+            'save_cycle_store': save_cycle_store}
+
+
+def load_state(data, index, filename='main_out/incremental_state.json'):
+    """Function to read how many half cycles were processed by the last
+    incremental run.
+
+    The state is only trusted if the settings are the same and the last
+    processed row of the data still has the same half cycle and time;
+    otherwise everything is processed again.
+
+    Arguments:
+    data = pandas dataframe object
+    index = half cycle index returned by build_half_cycle_index
+    filename = state file written by save_state
+
+    Returns:
+    Number of half cycles (rows of index) already processed
+    """
+    try:
+        with open(filename) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return 0
+
+    done = state['half cycles']
+    if (state['settings'] != incremental_settings() or done > len(index) or done == 0
+            or int(index['stop'].iloc[done-1]) != state['rows']
+            or int(index['half cycle'].iloc[done-1]) != state['half cycle']
+            or float(data['time/s'].iloc[state['rows']-1]) != state['time']):
+        print('Incremental state does not match the data or settings; processing all half cycles.')
+        return 0
+    return done
+
+
+def save_state(data, index, filename='main_out/incremental_state.json'):
+    """Function to record the last processed row and half cycle.
+
+    Arguments:
+    data = pandas dataframe object
+    index = half cycle index of the processed half cycles
+    filename = state file
+
+    Returns:
+    None
+    """
+    if len(index) == 0:
+        return None
+    rows = int(index['stop'].iloc[-1])
+    state = {'half cycles': len(index), 'rows': rows,
+             'half cycle': int(index['half cycle'].iloc[-1]),
+             'time': float(data['time/s'].iloc[rows-1]),
+             'settings': incremental_settings()}
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w') as f:
+        json.dump(state, f, indent=1)
+    return None
+
+
+def gcpl_sequence_number(filename):
+    """Function to get the sequence number Biologic puts in front of the
+    technique name, e.g. 3 for test_03_GCPL_C01.mpr. Used to sort files to be
+    stitched; files without a number are sorted last, by name.
+
+    Argument:
+    filename = name of the .mpr file
+
+    Returns:
+    Tuple to sort by
+    """
+    match = re.search(r'_(\d+)_GCPL_', os.path.basename(filename))
+    if match is None:
+        return (1, 0, filename)
+    return (0, int(match.group(1)), filename)
+
+
+def stitch_data(filenames):
+    """
+    Function to read several .mpr files in parallel and join them, in the
+    given order, into one dataframe with a single preallocated copy.
+
+    'time/s' and 'half cycle' are rebased so that they continue from the
+    previous file if they start again from a lower value. Only columns present
+    in every file are kept. Prints the change in resident memory (Linux
+    only), which also counts the columns read from the files.
+
+    Argument:
+    filenames = list of .mpr files, in order
+
+    Returns:
+    data = pandas dataframe object
+    """
+    rss = current_rss()
+    with ThreadPoolExecutor(max_workers=stitch_workers) as pool:
+        frames = list(pool.map(read_mpr, filenames))
+
+    columns = [name for name in frames[0].columns if all(name in frame for frame in frames)]
+    rows = np.cumsum([0] + [len(frame) for frame in frames])
+    stitched = {}
+    for name in columns:
+        dtype = np.result_type(*[frame[name].dtype for frame in frames])
+        stitched[name] = np.empty(rows[-1], dtype=dtype)
+
+    for i, frame in enumerate(frames):
+        for name in columns:
+            stitched[name][rows[i]:rows[i+1]] = frame[name].to_numpy()
+        if rows[i] == 0 or len(frame) == 0:
+            continue    # Nothing stitched before this file, or nothing to shift
+        # Continue time and half cycle numbers from the last row of the
+        # previous file with rows; empty files are skipped
+        time = stitched['time/s']
+        if time[rows[i]] < time[rows[i]-1]:
+            time[rows[i]:rows[i+1]] += time[rows[i]-1] - time[rows[i]]
+        half_cycle = stitched['half cycle']
+        if half_cycle[rows[i]] <= half_cycle[rows[i]-1]:
+            half_cycle[rows[i]:rows[i+1]] += half_cycle[rows[i]-1] + 1 - half_cycle[rows[i]]
+
+    data = pd.DataFrame(stitched, copy=False)
+    if rss is None:
+        print('Stitched %d files (%d rows).' % (len(filenames), len(data)))
+    else:
+        print('Stitched %d files (%d rows); memory used %.1f MB.' % (len(filenames), len(data), current_rss() - rss))
+    return data
+
+
+def compact_data(data):
+    """Function to keep only the columns in load_columns and, if
+    compact_dtypes is True, store them in smaller types where it is safe:
+    voltages ('Ewe/V', 'control/V/mA') as float32 and integer columns
+    ('flags' bitfield, 'Ns', 'half cycle') as the smallest integer type that
+    holds their values. Time and charge columns stay float64.
+    Prints the memory saved.
+
+    Argument:
+    data = pandas dataframe object
+
+    Returns:
+    data = pandas dataframe object
+    """
+    before = data.memory_usage(index=False).sum()
+    n_columns = len(data.columns)
+    if load_columns is not None:
+        missing = [name for name in load_columns if name not in data.columns]
+        if len(missing) > 0:
+            print('Columns not found in .mpr data: ' + ', '.join(missing))
+        data = data[[name for name in load_columns if name in data.columns]]
+
+    if compact_dtypes:
+        compacted = {}
+        for name in data.columns:
+            values = data[name].to_numpy()
+            if name in ('Ewe/V', 'control/V/mA'):
+                values = values.astype(np.float32, copy=False)
+            elif np.issubdtype(values.dtype, np.integer) and len(values) > 0:
+                dtype = np.promote_types(np.min_scalar_type(values.min()), np.min_scalar_type(values.max()))
+                values = values.astype(dtype, copy=False)
+            compacted[name] = values
+        data = pd.DataFrame(compacted, index=data.index, copy=False)
+
+    after = data.memory_usage(index=False).sum()
+    print('Kept %d of %d columns; memory %.1f MB -> %.1f MB (saved %.1f MB).'
+          % (len(data.columns), n_columns, before/1024**2, after/1024**2, (before - after)/1024**2))
+    return data
+
+
+def pixel_buckets(x, n_buckets):
+    """Function to split points into n_buckets equal-width bins along x, e.g.
+    one bin per pixel column of a plot.
+
+    Arguments:
+    x = 1D numpy array, e.g. time; bins are contiguous if x is sorted
+    n_buckets = number of bins
+
+    Returns:
+    Integer array with the bin number of each point
+    """
+    if len(x) == 0:
+        return np.zeros(0, dtype=int)
+    span = x.max() - x.min()
+    if span == 0:
+        return np.zeros(len(x), dtype=int)
+    return np.minimum(((x - x.min())/span*n_buckets).astype(int), n_buckets - 1)
+
+
+def decimate_indices(buckets, *arrays):
+    """Function to pick the points to draw so that a line plot looks the same
+    as with all points: the first and last point of each bucket and the
+    points where each array has its min and max in that bucket. Peaks and
+    spikes are always kept.
+
+    Arguments:
+    buckets = bucket number of each point, returned by pixel_buckets
+    arrays = one or more 1D numpy arrays of the same length, e.g. y (and x)
+
+    Returns:
+    Sorted integer array of indices of the points to draw
+    """
+    if len(buckets) == 0:
+        return np.zeros(0, dtype=int)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    stops = np.append(starts[1:], len(buckets))
+    segment = np.repeat(np.arange(len(starts)), stops - starts)
+    keep = [starts, stops - 1]
+    for y in arrays:
+        for extremum in (np.minimum, np.maximum):
+            # First point in each bucket that equals the bucket min (max)
+            hits = np.flatnonzero(y == extremum.reduceat(y, starts)[segment])
+            keep.append(hits[np.unique(segment[hits], return_index=True)[1]])
+    return np.unique(np.concatenate(keep))
+
+
+# Figures are rendered by a pool of worker processes, see submit_figure
+SharedArray = namedtuple('SharedArray', ['name', 'shape', 'dtype'])
+_render_pool = None     # Created on first call of submit_figure
+_render_jobs = []       # (future, shared memory blocks, stage record) of each submitted figure
+PLOT_PARAMS = {'font.size': 16}   # rcParams of every figure, whichever stages run
+
+
+def _init_render_worker(params, settings):
+    """Use the non-interactive Agg backend, the main process' rcParams and
+    the settings of the current run in render worker processes."""
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+    mpl.rcParams.update(params)
+    globals().update(settings)
+
+
+def _share_array(value):
+    """Function to copy a large numpy array into shared memory, so that it is
+    not pickled when sent to a render worker.
+
+    Argument:
+    value = any argument of a drawing function
+
+    Returns:
+    SharedArray describing the copy and its SharedMemory block, or value and
+    None if value is not a large array or shared memory is not available
+    """
+    if shared_memory is None or not isinstance(value, np.ndarray) or value.nbytes < 64*1024:
+        return value, None
+    block = shared_memory.SharedMemory(create=True, size=value.nbytes)
+    np.ndarray(value.shape, value.dtype, buffer=block.buf)[...] = value
+    return SharedArray(block.name, value.shape, value.dtype.str), block
+
+
+def _render_job(draw, kwargs):
+    """Function run by a render worker: attaches shared arrays and draws.
+    Returns the time taken to draw in seconds."""
+    start = perf_counter()
+    blocks = []
+    for key, value in kwargs.items():
+        if isinstance(value, SharedArray):
+            block = shared_memory.SharedMemory(name=value.name)
+            blocks.append(block)
+            kwargs[key] = np.ndarray(value.shape, value.dtype, buffer=block.buf)
+    try:
+        draw(**kwargs)
+    finally:
+        # Closed figures may still hold views of the shared arrays
+        kwargs.clear()
+        gc.collect()
+        for block in blocks:
+            block.close()
+    return perf_counter() - start
+
+
+def submit_figure(draw, **kwargs):
+    """
+    Function to render a figure in a render worker process. Returns at once;
+    wait_for_figures waits until all submitted figures are saved.
+    If render_workers is 1, the figure is rendered here instead.
+
+    Arguments:
+    draw = module-level function that draws and saves the figure
+    kwargs = arguments of draw; numpy arrays larger than 64 kB are passed
+    through shared memory
+
+    Returns:
+    None
+
+    The drawing time is added to 'render time/s' of the stage that submits
+    the figure, once the figure is saved (see wait_for_figures).
+    """
+    import matplotlib as mpl
+    global _render_pool
+    mpl.rcParams.update(PLOT_PARAMS)
+    if render_workers == 1:
+        start = perf_counter()
+        draw(**kwargs)
+        if _current_stage is not None:
+            _current_stage['render time/s'] += perf_counter() - start
+        return None
+    if _render_pool is None:
+        params = {key: value for key, value in mpl.rcParams.items() if key != 'backend'}
+        if shared_memory is not None and os.name == 'posix':
+            # Workers must share this process' tracker of shared memory blocks;
+            # one started by a worker would unlink the blocks when it exits
+            resource_tracker.ensure_running()
+        _render_pool = ProcessPoolExecutor(max_workers=render_workers,
+                                           initializer=_init_render_worker,
+                                           initargs=(params, current_settings()))
+    shared = {}
+    blocks = []
+    for key, value in kwargs.items():
+        shared[key], block = _share_array(value)
+        if block is not None:
+            blocks.append(block)
+    _render_jobs.append((_render_pool.submit(_render_job, draw, shared), blocks, _current_stage))
+    return None
+
+
+def wait_for_figures():
+    """
+    Function to wait until all figures passed to submit_figure are saved,
+    free their shared memory and shut down the render workers. Errors raised
+    while drawing are raised here.
+
+    Arguments:
+    None
+
+    Returns:
+    Number of figures rendered by the workers
+    """
+    global _render_pool
+    n_figures = len(_render_jobs)
+    try:
+        for future, blocks, record in _render_jobs:
+            try:
+                render_time = future.result()
+                if record is not None:
+                    record['render time/s'] += render_time
+            finally:
+                for block in blocks:
+                    block.close()
+                    block.unlink()
+    finally:
+        del _render_jobs[:]
+        if _render_pool is not None:
+            _render_pool.shutdown()
+            _render_pool = None
+    return n_figures
+
+
+def _abort_figures():
+    """
+    Function to drop the figures passed to submit_figure that are not saved
+    yet, e.g. after a stage raised: cancels the jobs not started, waits for
+    the running ones, frees their shared memory and shuts down the render
+    workers, so that the next run starts new workers with its own folder and
+    settings. Errors raised while drawing are ignored.
+
+    Arguments:
+    None
+
+    Returns:
+    None
+    """
+    global _render_pool, _current_stage
+    for future, blocks, record in _render_jobs:
+        future.cancel()
+    try:
+        if _render_pool is not None:
+            _render_pool.shutdown()
+    finally:
+        _render_pool = None
+        for future, blocks, record in _render_jobs:
+            for block in blocks:
+                block.close()
+                block.unlink()
+        del _render_jobs[:]
+        _current_stage = None
+    return None
+
+
+# Each stage of run is recorded by stage, see save_stage_report
+_stage_records = []     # Dict of measurements of each finished stage
+_current_stage = None   # Record of the stage running now; its figures' render time is added to it
+
+
+def peak_rss():
+    """Peak resident memory of this process so far in MB, or None if the
+    resource module is not available (Windows)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return peak/1024**2 if sys.platform == 'darwin' else peak/1024
+
+
+def current_rss():
+    """Resident memory of this process now in MB, or None where
+    /proc/self/statm is not available (other than Linux)."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages*os.sysconf('SC_PAGE_SIZE')/1024**2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def reset_peak_rss():
+    """Function to reset the peak resident memory of this process, so that
+    stage_peak_rss gives the peak of one stage. Linux only.
+
+    Returns:
+    True if it was reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def stage_peak_rss():
+    """Peak resident memory in MB since reset_peak_rss, from
+    /proc/self/status."""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])/1024
+    return None
+
+
+def count_points(curves):
+    """Number of points in a dict returned by split_profiles,
+    compute_dQ_dV_data or compute_dV_dQ_data."""
+    return sum(len(curve[0]) for direction in curves.values() for curve in direction.values())
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Context manager that records wall time, CPU time and memory of one
+    stage of run for save_stage_report, and profiles the stage with
+    cProfile if profile_stages is True. CPU time is that of this process
+    only. Figures are drawn by the render workers while later stages run;
+    the time taken to draw the figures a stage submits is added to its
+    'render time/s' when they are saved.
+
+    Memory is the change in resident memory of this process over the stage
+    ('rss delta/MB') and its peak during the stage ('peak rss/MB'), on
+    Linux; None elsewhere.
+
+    Argument:
+    name = name of the stage
+
+    Yields:
+    dict of the stage's measurements; set 'rows' to the number of rows or
+    points the stage processed
+
+    Example:
+    with stage('load') as record:
+        values['load'] = compact_data(data)
+        record['rows'] = len(values['load'])
+    """
+    global _current_stage
+    record = {'stage': name, 'rows': None, 'render time/s': 0.0}
+    profiler = cProfile.Profile() if profile_stages else None
+    outer_stage, _current_stage = _current_stage, record
+    rss = current_rss()
+    reset = rss is not None and reset_peak_rss()
+    wall, cpu = perf_counter(), process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        record['wall time/s'] = perf_counter() - wall
+        record['cpu time/s'] = process_time() - cpu
+        record['rss delta/MB'] = None if rss is None else current_rss() - rss
+        record['peak rss/MB'] = stage_peak_rss() if reset else None
+        _current_stage = outer_stage
+        _stage_records.append(record)
+        if profiler is not None:
+            os.makedirs('main_out/stage_profiles', exist_ok=True)
+            profiler.dump_stats('main_out/stage_profiles/' + name + '.prof')
+
+
+def save_stage_report(filename='main_out/stage_report.json'):
+    """
+    Function to save the measurements of all stages recorded by stage to a
+    JSON file, with the totals of the run and the settings that affect the
+    results, so that runs can be compared.
+
+    Argument:
+    filename = path of the report
+
+    Returns:
+    None
+    """
+    # reset_peak_rss also resets the peak that peak_rss reads on Linux
+    peaks = [peak_rss()] + [record['peak rss/MB'] for record in _stage_records]
+    peaks = [peak for peak in peaks if peak is not None]
+    report = {'started': startTime.isoformat(),
+              'total wall time/s': (datetime.now() - startTime).total_seconds(),
+              'total cpu time/s': process_time() - startCpuTime,
+              'peak rss/MB': max(peaks) if peaks else None,
+              'render workers': render_workers or os.cpu_count(),
+              'settings': incremental_settings(),
+              'stages': _stage_records}
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(str(datetime.now() - startTime)+' Saved stage report.')
+    return None
+
+
+# Functions: Called by main
+def mpr_files():
+    """
+    Function to find the .mpr file(s) data_tailor reads: all files with
+    'GCPL' in the name, in order of sequence number, if there are any and
+    stitch_files is True; otherwise the first .mpr file found.
+
+    Arguments:
+    None
+
+    Returns:
+    List of file names
+    """
+    gcpl_filelist = glob.glob('*_GCPL_*.mpr')   # List of files with 'GCPL' in filename
+    if len(gcpl_filelist) > 0 and stitch_files:
+        return sorted(gcpl_filelist, key=gcpl_sequence_number)
+    return glob.glob('*.mpr')[:1]   # First .mpr file
+
+
+def data_tailor():
+    """
+    Function to stitch data from multiple files into one dataframe.
+
+    In tests with multiple steps, e.g. EIS and GCPL, the Biologic inserts a tag
+    into each filename with the type of step. If there are multiple GCPL steps in
+    a given test protocol and stitch_files is True, they are concatenated in the
+    order of the sequence number in their filenames into a single dataframe.
+    If either condition is not met, it defaults to the first .mpr file it finds.
+
+    Arguments:
+    None
+
+    Returns:
+    data: A Pandas dataframe instance
+    """
+    # Read data from mpr file into pandas dataframe object
+    filenames = mpr_files()
+    if len(filenames) > 1:
+        data = stitch_data(filenames)
+    else:
+        data = read_mpr(filenames[0])
+    data = compact_data(data)
+    print(str(datetime.now() - startTime)+' Read data.')
+    return data
+
+
+def draw_time_series(time, y, quantity, plot_name, xmax):
+    """
+    Draws and saves a time series plot (quantity vs time in hours).
+
+    Arguments:
+    time = time in seconds of the points to draw
+    y = quantity at those points
+    quantity = quantity plotted on y axis
+    plot_name = plot name
+    xmax = end of the test in seconds
+
+    Returns:
+    None
+    """
+    import matplotlib.pyplot as plt
+    plt.figure(figsize=(16,4))
+    plt.plot(time/3600, y)
+    plt.xlim([0, xmax/3600])
+    plt.xlabel('Time (hr)')
+    plt.ylabel(quantity)
+    plt.savefig(plot_name, bbox_inches='tight')
+    plt.close()
+    return None
+
+
+def plot_time_series(data, quantity, plot_name, buckets=None):
+    """
+    Plots time series (quantity vs time in hours).
+
+    Arguments: 
+    data = pandas dataframe object
+    quantity = quantity to be plotted on y axis
+    plot_name = plot name
+    buckets = bucket number of each point returned by pixel_buckets; if given,
+    only the points returned by decimate_indices are drawn
+
+    Returns:
+    None
+    """
+    os.makedirs('time_series',exist_ok=True)
+    time = data['time/s'].to_numpy()
+    y = data[quantity].to_numpy()
+    if buckets is not None:
+        points = decimate_indices(buckets, y)
+        time = time[points]
+        y = y[points]
+    submit_figure(draw_time_series, time=time, y=y, quantity=quantity, plot_name=plot_name,
+                  xmax=data['time/s'].max())
+    return None
+
+
+def plot_all_time_series(data):
+    """Function to plot all the time series plots.
+    Plots:
+    Voltage vs time
+    Charge/discharge capacity per cycle vs time
+    Charge/discharge capacity ref. to initial capacity vs time
+    Control voltage/current vs time
+    dQ (difference in charge between time steps i.e. current * dt) vs time
+    Ns (input conditions i.e. 1, 2 or 3) vs time
+    Half cycle number vs time
+
+    Arguments:
+    data = pandas dataframe object"""
+    import matplotlib as mpl
+    # Same time buckets (two per pixel column) for all plots
+    buckets = None
+    if decimate_plots:
+        buckets = pixel_buckets(data['time/s'].to_numpy(), 2*16*int(mpl.rcParams['figure.dpi']))
+    plot_time_series(data=data, quantity='Ewe/V', plot_name='time_series/voltage.png', buckets=buckets)
+    plot_time_series(data=data, quantity='Q charge/discharge/mA.h', plot_name='time_series/charge_per_cycle.png', buckets=buckets)
+    plot_time_series(data=data, quantity='(Q-Qo)/mA.h', plot_name='time_series/charge_referenced_to_initial.png', buckets=buckets)
+    plot_time_series(data=data, quantity='control/V/mA', plot_name='time_series/control.png', buckets=buckets)
+    plot_time_series(data=data, quantity='dQ/mA.h', plot_name='time_series/dQ.png', buckets=buckets)
+    plot_time_series(data=data, quantity='Ns', plot_name='time_series/Ns.png', buckets=buckets)
+    plot_time_series(data=data, quantity='half cycle', plot_name='time_series/half_cycle.png', buckets=buckets)
+    print(str(datetime.now() - startTime)+' Queued all time series plots.')
+    return None
+
+
+def draw_voltage_capacity(capacity, voltage, xlim):
+    """
+    Draws and saves voltage vs capacity referenced to initial capacity.
+
+    Arguments:
+    capacity = capacity of the points to draw
+    voltage = voltage of the points to draw
+    xlim = [min, max] capacity of all points
+
+    Returns:
+    None
+    """
+    import matplotlib.pyplot as plt
+    plt.figure(figsize=(16,4))
+    plt.plot(capacity, voltage, '-')
+    plt.xlim(xlim)
+    plt.xlabel('Capacity (mAh)')
+    plt.ylabel('Voltage (V)')
+    plt.ylim(voltage_limits)
+    plt.savefig('main_out/voltage_vs_capacity.png', bbox_inches='tight')
+    plt.close()
+    return None
+
+
+def plot_voltage_capacity_ref_initial(data):
+    """
+    Function to plot voltage vs capacity referenced to initial capacity.
+    
+    Argument: 
+    data = pandas dataframe object
+
+    Returns:
+    None
+    """
+    import matplotlib as mpl
+
+    os.makedirs('main_out',exist_ok=True)
+    capacity = -1*data['(Q-Qo)/mA.h'].to_numpy()
+    voltage = data['Ewe/V'].to_numpy()
+    if decimate_plots:
+        # Bucket by time, keeping the extremes of both capacity and voltage
+        buckets = pixel_buckets(data['time/s'].to_numpy(), 2*16*int(mpl.rcParams['figure.dpi']))
+        points = decimate_indices(buckets, capacity, voltage)
+        capacity_plotted, voltage_plotted = capacity[points], voltage[points]
+    else:
+        capacity_plotted, voltage_plotted = capacity, voltage
+    submit_figure(draw_voltage_capacity, capacity=capacity_plotted, voltage=voltage_plotted,
+                  xlim=[capacity.min(), capacity.max()])
+    print(str(datetime.now() - startTime)+' Queued voltage vs capacity ref. initial plot.')
+    return None
+
+
+def summarize_cycles(data, index):
+    """
+    Function to reduce each half cycle to one row of a per-cycle table.
+    The nth charge is paired with the nth discharge.
+
+    Arguments:
+    data = pandas dataframe object
+    index = half cycle index returned by build_half_cycle_index
+
+    Returns:
+    summary = pandas dataframe with one row per cycle and columns
+        'cycle': cycle number, starting from 1
+        'charge capacity/mA.h', 'discharge capacity/mA.h': max capacity
+        'coulombic efficiency/%': charge capacity/discharge capacity*100
+        'charge energy/mW.h', 'discharge energy/mW.h': sum of V*|dQ|
+        'charge average voltage/V', 'discharge average voltage/V': energy/sum of |dQ|
+        'charge duration/s', 'discharge duration/s': time from first to last point
+    Values are NaN for a cycle that has no charge or no discharge.
+    """
+    starts = index['start'].to_numpy()
+    stops = index['stop'].to_numpy()
+    v = data['Ewe/V'].to_numpy(dtype=float)
+    dq = np.abs(data['dQ/mA.h'].to_numpy())
+    time = data['time/s'].to_numpy()
+
+    # Sum V*|dQ| and |dQ| over each half cycle in one pass
+    if len(starts) > 0:
+        energy = np.add.reduceat(v*dq, starts)
+        charge = np.add.reduceat(dq, starts)
+    else:
+        energy = charge = np.zeros(0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average_voltage = energy/charge
+
+    half_cycles = pd.DataFrame({'cycle': index['cycle'], 'capacity': index['capacity'],
+                                'energy': energy, 'average voltage': average_voltage,
+                                'duration': time[stops - 1] - time[starts]})
+
+    ch = half_cycles[~index['discharge']].set_index('cycle')
+    disch = half_cycles[index['discharge']].set_index('cycle')
+    summary = pd.DataFrame(index=ch.index.union(disch.index).rename('cycle'))
+    summary['charge capacity/mA.h'] = ch['capacity']
+    summary['discharge capacity/mA.h'] = disch['capacity']
+    summary['coulombic efficiency/%'] = summary['charge capacity/mA.h']/summary['discharge capacity/mA.h']*100
+    for quantity, unit in (('energy', 'mW.h'), ('average voltage', 'V'), ('duration', 's')):
+        summary['charge ' + quantity + '/' + unit] = ch[quantity]
+        summary['discharge ' + quantity + '/' + unit] = disch[quantity]
+    return summary.reset_index()
+
+
+def save_capacity_data(summary, index, done=0):
+    """
+    Function to save the per-cycle table to main_out/cycle_summary.csv and
+    charge capacities, discharge capacities and Coulombic efficiencies to
+    main_out/charge_capacities.txt, main_out/discharge_capacities.txt and
+    main_out/coulombic_efficiencies.txt.
+
+    Arguments:
+    summary = per-cycle table returned by summarize_cycles
+    index = half cycle index the table was computed from
+    done = number of half cycles already saved by a previous run; values
+    for those are not written again, new values are appended
+
+    Returns:
+    None
+    """
+    os.makedirs('main_out',exist_ok=True)
+    summary.to_csv('main_out/cycle_summary.csv', index=False)
+
+    n_disch = int(index['discharge'].iloc[:done].sum())
+    n_ch = done - n_disch
+    mode = 'a' if done > 0 else 'w'
+    for filename, column, n_saved in (
+            ('main_out/discharge_capacities.txt', 'discharge capacity/mA.h', n_disch),
+            ('main_out/charge_capacities.txt', 'charge capacity/mA.h', n_ch),
+            ('main_out/coulombic_efficiencies.txt', 'coulombic efficiency/%', min(n_ch, n_disch))):
+        with open(filename, mode) as f:
+            np.savetxt(f, summary[column].dropna().to_numpy()[n_saved:])
+    print(str(datetime.now() - startTime)+' Saved capacity data.')
+    return None
+
+
+def draw_capacity_vs_cycle(capacity, name, color, plot_name):
+    """
+    Draws and saves charge or discharge capacity vs cycles.
+
+    Arguments:
+    capacity = capacity of each cycle
+    name = 'Charge' or 'Discharge'
+    color = line color
+    plot_name = plot name
+
+    Returns:
+    None
+    """
+    import matplotlib.pyplot as plt
+    plt.figure()
+    plt.plot(np.arange(start=1, stop=len(capacity)+1, step=1), 
+    capacity, linestyle='solid', color=color, linewidth=3, markersize=15)
+    plt.xlabel('Number of cycles', 
+    fontweight='bold', fontname='Times New Roman', fontsize=20)
+    plt.ylabel(name + ' capacity (mAh)', 
+    fontweight='bold', fontname='Times New Roman', fontsize=20)
+    plt.title(name + ' capacity vs cycles', 
+    fontweight='bold', fontname='Times New Roman', fontsize=20)
+    plt.xlim(0, len(capacity)+1)
+    plt.ylim(0, 1.05*max(capacity))
+    plt.minorticks_on()
+    plt.tick_params(axis='both', which='minor', length=4, width=1)
+    plt.tick_params(axis='both', which='major', labelsize=14, length=7, width=1.5)
+    plt.savefig(plot_name, bbox_inches='tight', dpi=300)
+    plt.close()
+    return None
+
+
+def draw_coulombic_efficiency(y):
+    """
+    Draws and saves Coulombic efficiency vs cycles.
+
+    Argument:
+    y = Coulombic efficiency of each cycle in %
+
+    Returns:
+    None
+    """
+    import matplotlib.pyplot as plt
+    num_cycles = len(y)
+    x = np.arange(start=1, stop=num_cycles+1, step=1)
+
+    plt.figure()
+    plt.plot(x, y, linestyle='solid', color=color_CE, linewidth=3, markersize=15)
+
+    if CE_ylim is not None:
+        plt.ylim(CE_ylim)
+    else:
+        if CE_100pc_line:       # Plot 100% line
+            plt.plot(x, [100]*len(x), 
+            linestyle='dashed', color='k', linewidth=3, markersize=15) 
+            plt.ylim(min(*y,100)-2, max(*y, 100)+2)
+        else:
+            plt.ylim(min(y)-2, max(y)+2)
+    plt.xlim(1, num_cycles)
+
+    plt.xlabel('Number of cycles',
+    fontweight='bold', fontname='Times New Roman', fontsize=20)
+    plt.ylabel('Coulombic efficiency (%)',
+    fontweight='bold', fontname='Times New Roman', fontsize=20)
+    plt.title('Coulombic efficiency vs cycles',
+    fontweight='bold', fontname='Times New Roman', fontsize=20)
+    plt.minorticks_on()
+    plt.tick_params(axis='both', which='minor', length=4, width=1)
+    plt.tick_params(axis='both', which='major', labelsize=14, length=7, width=1.5)
+    plt.savefig('main_out/coulombic_efficiency_vs_cycles.png', bbox_inches='tight', dpi=300)
+    plt.close()
+    return None
+
+
+def plot_capacity_vs_cycle(summary):
+    """
+    Function to plot charge/discharge capacity vs cycles.
+    Also plots Coulombic efficiency vs cycles.
+
+    Argument:
+    summary = per-cycle table returned by summarize_cycles
+    
+    Returns:
+    None
+    """
+
+    os.makedirs('main_out',exist_ok=True)
+    submit_figure(draw_capacity_vs_cycle, capacity=summary['discharge capacity/mA.h'].dropna().to_numpy(),
+                  name='Discharge', color=color_disch, plot_name='main_out/discharge_capacity_vs_cycles.png')
+    submit_figure(draw_capacity_vs_cycle, capacity=summary['charge capacity/mA.h'].dropna().to_numpy(),
+                  name='Charge', color=color_ch, plot_name='main_out/charge_capacity_vs_cycles.png')
+    print(str(datetime.now() - startTime)+' Queued charge/discharge capacity vs cycles plots.')
+
+    submit_figure(draw_coulombic_efficiency, y=summary['coulombic efficiency/%'].dropna().to_numpy())
+    print(str(datetime.now() - startTime)+' Queued Coulombic efficiency vs cycles plot.')
+    return None
+
+
+def pack_profiles(profiles):
+    """
+    Function to pack profiles of one direction into two flat arrays, so that
+    they can be sent to a render worker through shared memory.
+
+    Argument:
+    profiles = dict of cycle: (capacity, voltage) e.g. profiles['charge']
+
+    Returns:
+    cycles = array of cycle numbers
+    q, v = concatenated capacity and voltage of all profiles
+    offsets = profile i is q[offsets[i]:offsets[i+1]]
+    """
+    cycles = np.array(list(profiles.keys()), dtype=int)
+    offsets = np.zeros(len(profiles) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(q) for q, v in profiles.values()])
+    if len(profiles) == 0:
+        return cycles, np.zeros(0), np.zeros(0), offsets
+    q = np.concatenate([q for q, v in profiles.values()])
+    v = np.concatenate([v for q, v in profiles.values()])
+    return cycles, q, v, offsets
+
+
+def cycle_frames(cycles, q, v, offsets, direction, xmax=None):
+    """
+    Generator that renders the profile of each cycle on a single figure,
+    which is created once; only the line data and title change between
+    cycles. If xmax is given the axes are the same for all cycles, so they
+    are drawn once and each frame only redraws the line and title on top.
+
+    Arguments:
+    cycles, q, v, offsets = profiles returned by pack_profiles
+    direction = 'charge' or 'discharge'
+    xmax = upper capacity limit of all plots; None scales to each cycle
+
+    Yields:
+    cycle number, RGBA image of that cycle; the image is a view of the
+    figure's canvas and is overwritten by the next cycle
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    fixed = xmax is not None
+    fig = Figure()
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    line, = ax.plot([], [], '-o', animated=fixed)
+    title = ax.set_title('', animated=fixed)
+    ax.set_xlabel('Capacity (mAh)')
+    ax.set_ylabel('Voltage (V)')
+    ax.set_ylim(voltage_limits)
+    if fixed:
+        ax.set_xlim([0, xmax])
+        canvas.draw()
+        background = canvas.copy_from_bbox(fig.bbox)
+    for i, n in enumerate(cycles):
+        line.set_data(q[offsets[i]:offsets[i+1]], v[offsets[i]:offsets[i+1]])
+        title.set_text(str(n) + '$^{th}$ ' + direction)
+        if fixed:
+            canvas.restore_region(background)
+            ax.draw_artist(line)
+            ax.draw_artist(title)
+        else:
+            ax.relim()
+            ax.autoscale_view(scaley=False)
+            canvas.draw()
+        yield n, np.asarray(canvas.buffer_rgba())
+
+
+def draw_cycle_profiles(cycles, q, v, offsets, direction, xmax=None, video_name=None):
+    """
+    Draws and saves one plot per cycle in cycles/ directory. If video_name is
+    given, each frame is also written to that video as soon as it is drawn,
+    so memory use does not grow with the number of cycles.
+
+    Arguments:
+    cycles, q, v, offsets = profiles returned by pack_profiles
+    direction = 'charge' or 'discharge'
+    xmax = upper capacity limit of all plots; None uses the default limits
+    video_name = .mp4 file to write the frames to, at fps frames per second;
+    not written if there are no cycles
+
+    Returns:
+    None
+    """
+    import cv2
+    video = None
+    try:
+        for n, frame in cycle_frames(cycles, q, v, offsets, direction, xmax):
+            image = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+            # OpenCV's PNG encoder is several times faster than savefig's
+            cv2.imwrite('cycles/' + direction + '_' + str(n) + '.png', image)
+            if video_name is not None:
+                if video is None:
+                    height, width, layers = image.shape
+                    video = cv2.VideoWriter(video_name, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+                video.write(image)
+    finally:
+        if video is not None:
+            video.release()
+    return None
+
+
+def draw_combined_profiles(q, v, offsets, title, plot_name):
+    """
+    Draws and saves all profiles of one direction in a single plot, colored
+    from color1 (first cycle) to color2 (last cycle). All profiles are drawn
+    as one LineCollection instead of one line per cycle.
+
+    Arguments:
+    q, v, offsets = profiles returned by pack_profiles
+    title = plot title
+    plot_name = plot name
+
+    Returns:
+    None
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+    n_profiles = len(offsets) - 1
+    segments = []
+    if n_profiles > 0:
+        segments = np.split(np.column_stack((q, v)), offsets[1:-1])
+    plt.figure()
+    ax = plt.gca()
+    ax.add_collection(LineCollection(segments, colors=color_gradient(color1, color2, np.arange(n_profiles)/n_profiles),
+                                     capstyle='projecting', joinstyle='round'))
+    ax.autoscale_view()
+    plt.title(title)
+    plt.xlabel('Capacity (mAh)')
+    plt.ylabel('Voltage (V)')
+    plt.ylim(voltage_limits)
+    plt.savefig(plot_name)
+    plt.close()
+    return None
+
+
+def plot_charge_discharge_profiles(profiles, summary, new_profiles=None):
+    """Plots charge/discharge profiles for each cycle in cycles/ directory,
+    makes a video of those plots, and
+    plots all charge and discharge profiles in a single plot.
+    Raw profile data is saved by save_cycles_data.
+    Arguments:
+    profiles = dict of (capacity, voltage) profiles returned by split_profiles
+    summary = per-cycle table returned by summarize_cycles
+    new_profiles = profiles to plot in cycles/ directory; defaults to all.
+    All profiles are plotted in the combined plots.
+    """
+    if new_profiles is None:
+        new_profiles = profiles
+
+    if plot_all_cycles:
+        os.makedirs('cycles',exist_ok=True)
+    make_video = plot_all_cycles and save_to_video and not incremental
+    n_chunks = render_workers or os.cpu_count() or 1
+
+
+    ###############################################################################
+    # Plot each charge and discharge profile in cycles/ directory
+    ###############################################################################
+    for direction in ('discharge', 'charge'):
+        if not plot_all_cycles:
+            break
+        xmax = None
+        if same_xlim_every_cycle == True:
+            xmax = summary[direction + ' capacity/mA.h'].max()
+        cycles, q, v, offsets = pack_profiles(new_profiles[direction])
+        if make_video:
+            # Frames must reach the video in order, so one job per direction
+            submit_figure(draw_cycle_profiles, cycles=cycles, q=q, v=v, offsets=offsets, direction=direction,
+                          xmax=xmax, video_name='main_out/' + direction + '_profiles.mp4')
+            continue
+        # One job per worker, each with a contiguous range of cycles
+        for chunk in np.array_split(np.arange(len(cycles)), n_chunks):
+            if len(chunk) == 0:
+                continue
+            start, stop = offsets[chunk[0]], offsets[chunk[-1] + 1]
+            submit_figure(draw_cycle_profiles, cycles=cycles[chunk], q=q[start:stop], v=v[start:stop],
+                          offsets=offsets[chunk[0]:chunk[-1] + 2] - start, direction=direction, xmax=xmax)
+
+
+    ###############################################################################
+    # Plot all charge and discharge profiles in a single plot each
+    ###############################################################################
+    for direction, title in (('discharge', 'Discharge cycles'), ('charge', 'Charge cycles')):
+        cycles, q, v, offsets = pack_profiles(profiles[direction])
+        submit_figure(draw_combined_profiles, q=q, v=v, offsets=offsets, title=title,
+                      plot_name='main_out/combined_' + direction + '_profiles.png')
+    print(str(datetime.now() - startTime)+' Queued charge/discharge profile plots.')
+
+
+def draw_dqdv_heatmap(cycles, matrix, edges, direction):
+    """
+    Draws and saves dQ/dV of all cycles of one direction as a heatmap.
+
+    Arguments:
+    cycles = array of cycle numbers, one per row of matrix
+    matrix = 2D numpy array (cycles x voltage bins) of dQ/dV
+    edges = voltage bin edges
+    direction = 'charge' or 'discharge'
+
+    Returns:
+    None
+    """
+    import matplotlib.pyplot as plt
+    plt.figure()
+    # Discharge dQ/dV is negative; reverse the colormap so that peaks are bright either way
+    plt.imshow(matrix, aspect='auto', origin='lower', interpolation='nearest',
+               cmap='viridis_r' if direction == 'discharge' else 'viridis',
+               extent=[edges[0], edges[-1], cycles[0] - 0.5, cycles[-1] + 0.5])
+    plt.colorbar(label='dQ/dV (mAh/V)')
+    plt.title(direction.capitalize() + ' dQ/dV')
+    plt.xlabel('Voltage (V)')
+    plt.ylabel('Cycle number')
+    plt.savefig('main_out/dqdv_heatmap_' + direction + '.png', bbox_inches='tight', dpi=200)
+    plt.close()
+    return None
+
+
+def plot_dqdv_heatmaps(dqdv):
+    """
+    Function to plot dQ/dV vs voltage and cycle number as a heatmap for
+    charge and discharge, using the histogram dQ/dV of all cycles.
+
+    Argument:
+    dqdv = dict returned by compute_dQ_dV_data with dqdv_method =
+    'histogram', smoothed or not, of all cycles
+
+    Returns:
+    None
+    """
+    if dqdv_method != 'histogram':
+        raise ValueError("The dQ/dV heatmaps need dqdv_method = 'histogram', not " + repr(dqdv_method))
+    os.makedirs('main_out',exist_ok=True)
+    edges = np.linspace(voltage_limits[0], voltage_limits[1], dqdv_bins + 1)
+    for direction in ('charge', 'discharge'):
+        curves = dqdv[direction]
+        if len(curves) > 0:
+            # All cycles share the bin centers; one row per cycle
+            cycles = np.fromiter(curves, dtype=int, count=len(curves))
+            matrix = np.vstack([y for x, y in curves.values()])
+            submit_figure(draw_dqdv_heatmap, cycles=cycles, matrix=matrix, edges=edges, direction=direction)
+    print(str(datetime.now() - startTime)+' Queued dQ/dV heatmaps.')
+    return None
+
+
+def split_profiles(data, index):
+    """
+    Function to split the data into charge and discharge profiles.
+
+    Arguments:
+    data = pandas dataframe object
+    index = half cycle index returned by build_half_cycle_index
+
+    Returns:
+    profiles = dict with 'charge' and 'discharge' keys; each value is a dict
+    of cycle number: (capacity, voltage) tuple of numpy arrays, in order.
+    Discharge capacity is positive.
+    """
+    q_all = data['Q charge/discharge/mA.h'].to_numpy(dtype=float)
+    v_all = data['Ewe/V'].to_numpy(dtype=float)
+    profiles = {'charge': {}, 'discharge': {}}
+    for start, stop, discharge, cycle in zip(index['start'], index['stop'], index['discharge'], index['cycle']):
+        if discharge:
+            profiles['discharge'][cycle] = (-1*q_all[start:stop], v_all[start:stop])
+        else:
+            profiles['charge'][cycle] = (q_all[start:stop], v_all[start:stop])
+    return profiles
+
+
+def compute_dQ_dV_data(profiles):
+    """
+    Function to compute dQ/dV for every charge and discharge profile.
+
+    Argument:
+    profiles = dict of (capacity, voltage) profiles returned by split_profiles
+
+    Returns:
+    dict with 'charge' and 'discharge' keys; each value is a dict of
+    cycle number: (voltage, dQ/dV) tuple of numpy arrays. With
+    dqdv_method = 'histogram' the voltages are the same bin centers for
+    all cycles.
+    """
+    if dqdv_method not in ('difference', 'histogram'):
+        raise ValueError("dqdv_method must be 'difference' or 'histogram', not " + repr(dqdv_method))
+
+    dqdv = {}
+    edges = np.linspace(voltage_limits[0], voltage_limits[1], dqdv_bins + 1)
+    for direction, direction_profiles in profiles.items():
+        if dqdv_method == 'histogram':
+            # Capacity per voltage bin; all cycles share the bin centers
+            cycles, matrix = dqdv_histogram(direction_profiles, edges, -1 if direction == 'discharge' else 1)
+            centers = (edges[1:] + edges[:-1])/2
+            dqdv[direction] = {cycle: (centers, matrix[i]) for i, cycle in enumerate(direction_profiles)}
+            continue
+        # Filter data: Remove point if voltage is the same as previous to dqdv_tol V;
+        # compute dQ/dV using forward difference, 1st and last point set to 0
+        dqdv[direction] = {cycle: compute_dqdv(q, v, dqdv_tol)
+                           for cycle, (q, v) in direction_profiles.items()}
+
+    print(str(datetime.now() - startTime)+' Computed dQ/dV data.')
+    return dqdv
+
+
+def compute_dV_dQ_data(profiles):
+    """
+    Function to compute dV/dQ for every charge and discharge profile.
+
+    Argument:
+    profiles = dict of (capacity, voltage) profiles returned by split_profiles
+
+    Returns:
+    dict with 'charge' and 'discharge' keys; each value is a dict of
+    cycle number: (capacity, dV/dQ) tuple of numpy arrays
+    """
+    dvdq = {}
+    for direction, direction_profiles in profiles.items():
+        # Filter data: Remove point if charge is the same as previous;
+        # compute dV/dQ using the finite difference set by dvdq_scheme
+        dvdq[direction] = {cycle: compute_dvdq(q, v, dvdq_scheme)
+                           for cycle, (q, v) in direction_profiles.items()}
+
+    print(str(datetime.now() - startTime)+' Computed dV/dQ data.')
+    return dvdq
+
+
+def smooth_cycles_data(curves, name):
+    """
+    Function to smooth every dQ/dV or dV/dQ curve with smooth_method. All
+    cycles of a direction are smoothed in one batched call.
+
+    Arguments:
+    curves = dict returned by compute_dQ_dV_data or compute_dV_dQ_data
+    name = 'dQ/dV' or 'dV/dQ', for the progress message
+
+    Returns:
+    dict like curves with the y values smoothed
+    """
+    smoothed = {}
+    for direction, direction_curves in curves.items():
+        cycles, x, y, offsets = pack_profiles(direction_curves)
+        y = smooth(x, y, offsets, smooth_method, smooth_window, smooth_order)
+        smoothed[direction] = {cycle: (x[offsets[i]:offsets[i+1]], y[offsets[i]:offsets[i+1]])
+                               for i, cycle in enumerate(cycles)}
+
+    print(str(datetime.now() - startTime)+' Smoothed ' + name + ' data.')
+    return smoothed
+
+
+def draw_dqdv_peaks(cycle, direction, rank, voltage):
+    """
+    Draws and saves the voltage of the dQ/dV peaks vs cycle number.
+
+    Arguments:
+    cycle, direction, rank, voltage = columns of main_out/dqdv_peaks.csv
+
+    Returns:
+    None
+    """
+    import matplotlib.pyplot as plt
+    plt.figure()
+    for name, marker in (('charge', '^'), ('discharge', 'v')):
+        for n in range(1, int(rank.max()) + 1 if len(rank) else 1):
+            select = (direction == name) & (rank == n)
+            if select.any():
+                plt.plot(cycle[select], voltage[select], marker, color='C' + str((n - 1) % 10),
+                         markersize=3, label=name.capitalize() + ' peak ' + str(n))
+    plt.title('dQ/dV peaks')
+    plt.xlabel('Cycle number')
+    plt.ylabel('Voltage (V)')
+    plt.ylim(voltage_limits)
+    plt.legend(fontsize='x-small', markerscale=2)
+    plt.savefig('main_out/dqdv_peaks.png', bbox_inches='tight', dpi=200)
+    plt.close()
+    return None
+
+
+def track_dqdv_peaks(dqdv, done=0):
+    """
+    Function to find the n_peaks highest dQ/dV peaks of every half cycle, all
+    half cycles of a direction at once, save them to main_out/dqdv_peaks.csv
+    (columns: cycle, direction, rank, voltage/V, dQdV/mA.h/V, width/V) and
+    plot their voltage vs cycle number. Discharge peaks are the most negative
+    dQ/dV values; width is the width in voltage at half height.
+
+    Arguments:
+    dqdv = dict returned by compute_dQ_dV_data (after smoothing, if any)
+    done = number of half cycles already saved by a previous run; peaks of
+    the half cycles in dqdv are added to the table, which is saved sorted
+    by cycle, direction and rank either way
+
+    Returns:
+    None
+    """
+    os.makedirs('main_out',exist_ok=True)
+    tables = []
+    for direction, curves in dqdv.items():
+        cycles, v, y, offsets = pack_profiles(curves)
+        sign = -1 if direction == 'discharge' else 1
+        row, rank, voltage, height, width = find_peaks(v, sign*y, offsets, n_peaks)
+        tables.append(pd.DataFrame({'cycle': cycles[row], 'direction': direction, 'rank': rank,
+                                    'voltage/V': voltage, 'dQdV/mA.h/V': sign*height, 'width/V': width}))
+    if done > 0:
+        # Keep the peaks saved by a previous run; a cycle's charge and
+        # discharge can be processed in different runs
+        tables.insert(0, pd.read_csv('main_out/dqdv_peaks.csv', float_precision='round_trip'))
+    peaks = pd.concat(tables).sort_values(['cycle', 'direction', 'rank'], kind='stable')
+    peaks.to_csv('main_out/dqdv_peaks.csv', index=False)
+
+    submit_figure(draw_dqdv_peaks, cycle=peaks['cycle'].to_numpy(), direction=peaks['direction'].to_numpy(),
+                  rank=peaks['rank'].to_numpy(), voltage=peaks['voltage/V'].to_numpy())
+    print(str(datetime.now() - startTime)+' Saved dQ/dV peaks.')
+    return None
+
+
+def save_cycles_data(profiles, dqdv, dvdq):
+    """
+    Function to save each profile to cycles/*_i.csv (columns: charge, voltage),
+    its dQ/dV to cycles/*_i_dQdV.csv (columns: voltage, dQ/dV) and
+    its dV/dQ to cycles/*_i_dVdQ.csv (columns: charge, dV/dQ),
+    where * = 'charge' or 'discharge' and i is integer representing cycle number.
+
+    Arguments:
+    profiles = dict returned by split_profiles
+    dqdv = dict returned by compute_dQ_dV_data
+    dvdq = dict returned by compute_dV_dQ_data
+
+    Returns:
+    None
+    """
+    os.makedirs('cycles',exist_ok=True)
+    for direction in profiles:
+        for cycle in profiles[direction]:
+            filename = 'cycles/' + direction + '_' + str(cycle)
+            np.savetxt(filename + '.csv', np.column_stack(profiles[direction][cycle]), delimiter=',')
+            np.savetxt(filename + '_dQdV.csv', np.column_stack(dqdv[direction][cycle]), delimiter=',')
+            np.savetxt(filename + '_dVdQ.csv', np.column_stack(dvdq[direction][cycle]), delimiter=',')
+
+    print(str(datetime.now() - startTime)+' Saved cycles data.')
+    return None
+
+
+###############################################################################
+# Stage graph
+###############################################################################
+# Each stage of run reads the values of its input stages and depends on some
+# settings. Its key is a hash of both (and of the .mpr files for 'load'), so a
+# stage only has to run again if its key changed. Values of stages with
+# store=True are kept in main_out/stage_cache/<stage>/; stages with files are
+# outputs, which write those files and return nothing.
+Stage = namedtuple('Stage', ['function', 'inputs', 'settings', 'store', 'files', 'enabled'])
+STAGE_CACHE = 'main_out/stage_cache'
+_done = 0   # Half cycles processed by the last incremental run; set by run
+
+
+def filter_ocv(data):
+    """Function to remove the OCV part (rows where dQ is 0) of every half
+    cycle if remove_OCV_part is True.
+
+    Argument:
+    data = pandas dataframe object
+
+    Returns:
+    data = pandas dataframe object
+    """
+    if remove_OCV_part:
+        data = data[data['dQ/mA.h'].to_numpy() != 0]
+    return data
+
+
+def segment_data(data):
+    """Function to build the half cycle index of the data. In incremental
+    mode the last half cycle is left out, as it may still be running.
+
+    Argument:
+    data = pandas dataframe object
+
+    Returns:
+    index = half cycle index returned by build_half_cycle_index
+    """
+    index = build_half_cycle_index(data)
+    if incremental:
+        index = index.iloc[:-1]
+    return index
+
+
+def new_cycles(curves, index):
+    """Function to keep the curves of the half cycles not processed by the
+    last incremental run, i.e. after the first _done rows of index.
+
+    Arguments:
+    curves = dict returned by split_profiles, compute_dQ_dV_data or
+    compute_dV_dQ_data
+    index = half cycle index the curves were split with
+
+    Returns:
+    dict like curves
+    """
+    if _done == 0:
+        return curves
+    new = index.iloc[_done:]
+    return {direction: {cycle: curves[direction][cycle]
+                        for cycle in new['cycle'][new['discharge'].to_numpy() == (direction == 'discharge')]}
+            for direction in curves}
+
+
+def smoothed_dqdv(profiles):
+    """dQ/dV of the profiles, smoothed if smooth_method is set."""
+    dqdv = compute_dQ_dV_data(profiles)
+    if smooth_method not in (None, 'None'):
+        dqdv = smooth_cycles_data(dqdv, 'dQ/dV')
+    return dqdv
+
+
+def dqdv_data(profiles, index):
+    """dQ/dV of the new profiles, smoothed if smooth_method is set."""
+    return smoothed_dqdv(new_cycles(profiles, index))
+
+
+def dvdq_data(profiles, index):
+    """dV/dQ of the new profiles, smoothed if smooth_method is set."""
+    dvdq = compute_dV_dQ_data(new_cycles(profiles, index))
+    if smooth_method not in (None, 'None'):
+        dvdq = smooth_cycles_data(dvdq, 'dV/dQ')
+    return dvdq
+
+
+def save_summary(summary, index):
+    """Function to save the per-cycle table; see save_capacity_data."""
+    return save_capacity_data(summary, index, _done)
+
+
+def plot_profiles(profiles, summary, index):
+    """Function to plot the profiles; see plot_charge_discharge_profiles."""
+    return plot_charge_discharge_profiles(profiles, summary, new_cycles(profiles, index))
+
+
+def plot_heatmaps(dqdv, profiles, index):
+    """Function to plot the dQ/dV heatmaps of all cycles; see
+    plot_dqdv_heatmaps. In incremental mode dqdv only has the new cycles, so
+    that of the cycles processed before is computed again."""
+    if _done > 0:
+        done = index.iloc[:_done]
+        old = smoothed_dqdv({direction: {cycle: profiles[direction][cycle] for cycle
+                                         in done['cycle'][done['discharge'].to_numpy() == (direction == 'discharge')]}
+                             for direction in profiles})
+        dqdv = {direction: {**old[direction], **dqdv[direction]} for direction in dqdv}
+    return plot_dqdv_heatmaps(dqdv)
+
+
+def save_peaks(dqdv):
+    """Function to save and plot the dQ/dV peaks; see track_dqdv_peaks."""
+    return track_dqdv_peaks(dqdv, _done)
+
+
+def save_store(profiles, dqdv, dvdq, summary, index):
+    """Function to save the new cycles to main_out/cycle_store/."""
+    write_store('main_out/cycle_store', new_cycles(profiles, index), dqdv, dvdq, summary, append=_done > 0)
+    print(str(datetime.now() - startTime)+' Saved cycle store.')
+    return None
+
+
+def save_cycles_csv_files(profiles, dqdv, dvdq, index):
+    """Function to save the new cycles to cycles/*.csv; see save_cycles_data."""
+    return save_cycles_data(new_cycles(profiles, index), dqdv, dvdq)
+
+
+def cached_cycles(keys):
+    """Cycle numbers of each direction of the cached 'profiles' value, or
+    None if it is not in the stage cache."""
+    meta = cached_meta('profiles', keys['profiles'])
+    if meta is None:
+        return None
+    return {direction: np.load(os.path.join(STAGE_CACHE, 'profiles', direction + '_cycles.npy'))
+            for direction in meta['directions']}
+
+
+def profile_plot_files(keys):
+    """Files written by plot_profiles, or None if they are not known."""
+    files = ['main_out/combined_charge_profiles.png', 'main_out/combined_discharge_profiles.png']
+    if not plot_all_cycles:
+        return files
+    cycles = cached_cycles(keys)
+    if cycles is None:
+        return None
+    for direction in ('discharge', 'charge'):
+        files += ['cycles/' + direction + '_' + str(cycle) + '.png' for cycle in cycles[direction]]
+        if save_to_video and not incremental and len(cycles[direction]):
+            files.append('main_out/' + direction + '_profiles.mp4')
+    return files
+
+
+def cycles_csv_files(keys):
+    """Files written by save_cycles_csv_files, or None if they are not known."""
+    cycles = cached_cycles(keys)
+    if cycles is None:
+        return None
+    return ['cycles/' + direction + '_' + str(cycle) + suffix
+            for direction in cycles for cycle in cycles[direction]
+            for suffix in ('.csv', '_dQdV.csv', '_dVdQ.csv')]
+
+
+# Stages in the order they run: values first, then outputs. Outputs run if
+# enabled() is True, unless other outputs are asked for (run(outputs=...)).
+# The files of an output are a tuple, or a function of the stage keys that
+# returns them (None if unknown) when they depend on the cycles.
+STAGES = {
+    'load': Stage(data_tailor, (), ('stitch_files', 'load_columns', 'compact_dtypes'), False, None, None),
+    'ocv_filter': Stage(filter_ocv, ('load',), ('remove_OCV_part',), False, None, None),
+    'segment': Stage(segment_data, ('ocv_filter',), ('incremental',), True, None, None),
+    'capacities': Stage(summarize_cycles, ('ocv_filter', 'segment'), (), True, None, None),
+    'profiles': Stage(split_profiles, ('ocv_filter', 'segment'), (), True, None, None),
+    'dqdv': Stage(dqdv_data, ('profiles', 'segment'),
+                  ('dqdv_method', 'dqdv_tol', 'dqdv_bins', 'voltage_limits',
+                   'smooth_method', 'smooth_window', 'smooth_order'), True, None, None),
+    'dvdq': Stage(dvdq_data, ('profiles', 'segment'),
+                  ('dvdq_scheme', 'smooth_method', 'smooth_window', 'smooth_order'), True, None, None),
+    'time_series': Stage(plot_all_time_series, ('load',), ('decimate_plots',),
+                         False, ('time_series/voltage.png', 'time_series/charge_per_cycle.png',
+                                 'time_series/charge_referenced_to_initial.png', 'time_series/control.png',
+                                 'time_series/dQ.png', 'time_series/Ns.png', 'time_series/half_cycle.png'),
+                         lambda: True),
+    'voltage_capacity': Stage(plot_voltage_capacity_ref_initial, ('load',), ('decimate_plots', 'voltage_limits'),
+                              False, ('main_out/voltage_vs_capacity.png',), lambda: True),
+    'capacity_files': Stage(save_summary, ('capacities', 'segment'), (),
+                            False, ('main_out/cycle_summary.csv', 'main_out/charge_capacities.txt',
+                                    'main_out/discharge_capacities.txt', 'main_out/coulombic_efficiencies.txt'),
+                            lambda: True),
+    'capacity_plots': Stage(plot_capacity_vs_cycle, ('capacities',),
+                            ('color_ch', 'color_disch', 'color_CE', 'CE_100pc_line', 'CE_ylim'),
+                            False, ('main_out/charge_capacity_vs_cycles.png', 'main_out/discharge_capacity_vs_cycles.png',
+                                    'main_out/coulombic_efficiency_vs_cycles.png'),
+                            lambda: True),
+    'profile_plots': Stage(plot_profiles, ('profiles', 'capacities', 'segment'),
+                           ('color1', 'color2', 'voltage_limits', 'same_xlim_every_cycle',
+                            'plot_all_cycles', 'save_to_video', 'fps'),
+                           False, profile_plot_files, lambda: True),
+    'dqdv_heatmaps': Stage(plot_heatmaps, ('dqdv', 'profiles', 'segment'), (),
+                           False, ('main_out/dqdv_heatmap_charge.png', 'main_out/dqdv_heatmap_discharge.png'),
+                           lambda: dqdv_method == 'histogram'),
+    'dqdv_peaks': Stage(save_peaks, ('dqdv',), ('n_peaks', 'voltage_limits'),
+                        False, ('main_out/dqdv_peaks.csv', 'main_out/dqdv_peaks.png'), lambda: track_peaks),
+    'cycle_store': Stage(save_store, ('profiles', 'dqdv', 'dvdq', 'capacities', 'segment'), (),
+                         False, ('main_out/cycle_store',), lambda: save_cycle_store),
+    'cycles_csv': Stage(save_cycles_csv_files, ('profiles', 'dqdv', 'dvdq', 'segment'), ('save_cycles_csv',),
+                        False, cycles_csv_files, lambda: save_cycles_csv),
+}
+OUTPUTS = tuple(name for name, stage_def in STAGES.items() if stage_def.files is not None)
+
+
+def stage_keys():
+    """
+    Function to compute the key of every stage from the settings it depends
+    on and the keys of its inputs. The key of 'load' also covers the name,
+    size and modification time of the .mpr file(s) it reads.
+
+    Arguments:
+    None
+
+    Returns:
+    dict of stage name: hex digest string
+    """
+    keys = {}
+    for name, stage_def in STAGES.items():
+        parts = {'stage': name, 'version': __version__,
+                 'settings': {setting: globals()[setting] for setting in stage_def.settings},
+                 'inputs': [keys[i] for i in stage_def.inputs]}
+        if name == 'load':
+            parts['files'] = [(filename, os.stat(filename).st_size, os.stat(filename).st_mtime_ns)
+                              for filename in mpr_files()]
+        text = json.dumps(parts, sort_keys=True, default=repr)
+        keys[name] = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    return keys
+
+
+def save_value(name, key, value):
+    """
+    Function to save the value of a stage to main_out/stage_cache/<name>/ as
+    one .npy file per column of a dataframe, or per array of pack_profiles
+    for each direction of a dict of curves.
+
+    Arguments:
+    name = stage name
+    key = key of the stage, from stage_keys
+    value = pandas dataframe, or dict of curves like split_profiles returns
+
+    Returns:
+    None
+    """
+    os.makedirs(STAGE_CACHE, exist_ok=True)
+    entry = os.path.join(STAGE_CACHE, name)
+    # Write to a temporary folder, then rename, so that a run stopped
+    # halfway never leaves a partly written entry
+    tmp_entry = tempfile.mkdtemp(dir=STAGE_CACHE, prefix=name + '.tmp')
+    if isinstance(value, pd.DataFrame):
+        meta = {'key': key, 'type': 'table', 'columns': list(value.columns)}
+        for i, column in enumerate(value.columns):
+            np.save(os.path.join(tmp_entry, str(i) + '.npy'), value[column].to_numpy())
+    else:
+        meta = {'key': key, 'type': 'curves', 'directions': list(value)}
+        for direction, curves in value.items():
+            for part, array in zip(('cycles', 'x', 'y', 'offsets'), pack_profiles(curves)):
+                np.save(os.path.join(tmp_entry, direction + '_' + part + '.npy'), array)
+    with open(os.path.join(tmp_entry, 'value.json'), 'w') as f:
+        json.dump(meta, f)
+    shutil.rmtree(entry, ignore_errors=True)
+    os.rename(tmp_entry, entry)
+    return None
+
+
+def cached_meta(name, key):
+    """Description of the cached value of a stage if it has the given key,
+    else None."""
+    try:
+        with open(os.path.join(STAGE_CACHE, name, 'value.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('key') == key else None
+
+
+def load_value(name, meta):
+    """
+    Function to load the value of a stage saved by save_value, with
+    memory-mapping.
+
+    Arguments:
+    name = stage name
+    meta = description returned by cached_meta
+
+    Returns:
+    pandas dataframe, or dict of curves
+    """
+    entry = os.path.join(STAGE_CACHE, name)
+    if meta['type'] == 'table':
+        return pd.DataFrame({column: np.load(os.path.join(entry, str(i) + '.npy'), mmap_mode='c')
+                             for i, column in enumerate(meta['columns'])}, copy=False)
+    value = {}
+    for direction in meta['directions']:
+        cycles, x, y, offsets = [np.load(os.path.join(entry, direction + '_' + part + '.npy'), mmap_mode='c')
+                                 for part in ('cycles', 'x', 'y', 'offsets')]
+        value[direction] = {int(cycle): (x[offsets[i]:offsets[i+1]], y[offsets[i]:offsets[i+1]])
+                            for i, cycle in enumerate(cycles)}
+    return value
+
+
+def count_rows(value):
+    """Number of rows of a dataframe or points of a dict of curves, for the
+    stage report."""
+    if isinstance(value, pd.DataFrame):
+        return len(value)
+    if isinstance(value, dict):
+        return count_points(value)
+    return None
+
+
+def stage_value(name, values, keys, cached):
+    """
+    Function to get the value of a stage: from values if it was already
+    computed in this run, from main_out/stage_cache/ if cached is True and
+    the stage's key did not change, or else by running the stage (and, in
+    turn, getting the values of its inputs).
+
+    Arguments:
+    name = stage name
+    values = dict of stage name: value computed so far in this run; updated
+    keys = dict returned by stage_keys
+    cached = True to load and save values in main_out/stage_cache/
+
+    Returns:
+    Value of the stage
+    """
+    if name in values:
+        return values[name]
+    stage_def = STAGES[name]
+    meta = cached_meta(name, keys[name]) if cached and stage_def.store else None
+    if meta is not None:
+        with stage(name) as record:
+            values[name] = load_value(name, meta)
+            record['rows'] = count_rows(values[name])
+            record['cached'] = True
+        print(str(datetime.now() - startTime)+' Loaded ' + name + ' from the stage cache.')
+        return values[name]
+
+    inputs = [stage_value(i, values, keys, cached) for i in stage_def.inputs]
+    with stage(name) as record:
+        values[name] = stage_def.function(*inputs)
+        # Outputs return None; count what they were made from
+        record['rows'] = count_rows(values[name] if stage_def.files is None else inputs[0])
+        if cached and stage_def.store:
+            save_value(name, keys[name], values[name])
+    return values[name]
+
+
+###############################################################################
+# Main
+###############################################################################
+startTime = datetime.now()
+startCpuTime = process_time()   # CPU time of this process when the run started; set by run
+
+
+def run(folder='.', data=None, outputs=None, **settings):
+    """
+    Function to run the stages of STAGES needed for the outputs on the cell
+    in folder and save the results to main_out/ etc. in that folder.
+
+    With stage_cache True, an output whose key (see stage_keys) is the same
+    as when it was last made, and whose files still exist, is skipped, and
+    stage values are loaded from main_out/stage_cache/ if their key did not
+    change; e.g. after changing color1 only the combined profile plots are
+    drawn again, from the cached profiles. The cache is not used in
+    incremental mode or with data.
+
+    Settings are module-level variables (see SETTINGS) that are changed for
+    the duration of the run, so runs in one process must not overlap, e.g.
+    from several threads; run cells in parallel with processes (batch.py).
+
+    Arguments:
+    folder = cell folder with the .mpr file(s)
+    data = dataframe shaped like the one read from an .mpr file by galvani,
+    used instead of reading the .mpr file(s); e.g. synthetic data for
+    benchmarks
+    outputs = names of the output stages to make (see OUTPUTS), e.g.
+    ['profile_plots']; None makes the outputs enabled by the settings
+    settings = values of any of SETTINGS for this run, e.g.
+    plot_all_cycles=True
+
+    Returns:
+    None
+    """
+    unknown = [name for name in settings if name not in SETTINGS]
+    if unknown:
+        raise TypeError('Unknown setting(s): ' + ', '.join(unknown))
+    unknown = [name for name in outputs or () if name not in OUTPUTS]
+    if unknown:
+        raise ValueError('Unknown output(s): ' + ', '.join(unknown))
+    defaults = {name: globals()[name] for name in settings}
+    cwd = os.getcwd()
+    globals().update(settings)
+    try:
+        os.chdir(folder)
+        _run_stages(data, outputs)
+    finally:
+        # Figures left by a failed run must not be drawn in the next one
+        _abort_figures()
+        os.chdir(cwd)
+        globals().update(defaults)
+    return None
+
+
+def _run_stages(data=None, outputs=None):
+    """Stages of run, in the working directory."""
+    global startTime, startCpuTime, _done
+    startTime = datetime.now()
+    startCpuTime = process_time()
+    del _stage_records[:]
+    print(str(datetime.now() - startTime)+' Started execution.')
+
+    # Make directories for plots
+    os.makedirs('pretty_plots/',exist_ok=True)
+
+    cached = stage_cache and not incremental and data is None
+    keys = stage_keys()
+    values = {}
+    if data is not None:
+        with stage('load') as record:
+            values['load'] = compact_data(data)
+            record['rows'] = len(values['load'])
+
+    _done = 0
+    if incremental:
+        # Skip half cycles done before
+        index = stage_value('segment', values, keys, cached)
+        _done = load_state(values['ocv_filter'], index)
+        print('%d of %d complete half cycles processed before.' % (_done, len(index)))
+
+    # Keys of the outputs as they were last made
+    try:
+        with open(os.path.join(STAGE_CACHE, 'outputs.json')) as f:
+            made = json.load(f)
+    except (OSError, ValueError):
+        made = {}
+    if outputs is None:
+        outputs = [name for name in OUTPUTS if STAGES[name].enabled()]
+    for name in OUTPUTS:
+        if name not in outputs:
+            continue
+        files = STAGES[name].files
+        if callable(files):
+            files = files(keys) if cached else None
+        if cached and made.get(name) == keys[name] and files is not None and all(os.path.exists(f) for f in files):
+            print(str(datetime.now() - startTime)+' Skipped ' + name + '; up to date.')
+            continue
+        stage_value(name, values, keys, cached)
+        made[name] = keys[name] if cached else None
+
+    with stage('wait_for_figures') as record:
+        record['rows'] = n_figures = wait_for_figures()
+    print(str(datetime.now() - startTime)+' Rendered %d queued figures.' % n_figures)
+
+    # Only record progress and outputs once their figures are rendered, so
+    # that half cycles whose figures failed are processed again next time
+    if incremental:
+        save_state(values['ocv_filter'], values['segment'])
+    os.makedirs(STAGE_CACHE, exist_ok=True)
+    with open(os.path.join(STAGE_CACHE, 'outputs.json'), 'w') as f:
+        json.dump({name: key for name, key in made.items() if key is not None}, f, indent=1)
+
+    if stage_report:
+        save_stage_report()
+
+    print("%s Finished execution."  % (datetime.now() - startTime) )
+    return None
+
+###############################################################################
+
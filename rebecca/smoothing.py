@@ -0,0 +1,166 @@
+"""
+Author: Venkatesh Krishnamurthy. Copyright 2022.
+
+Smoothing of dQ/dV and dV/dQ curves, batched over all cycles of a cell.
+
+Curves are passed the way cycle_store.py keeps them: the x and y values of
+all cycles concatenated into two flat arrays, plus offsets so that cycle i
+is rows offsets[i]:offsets[i+1]. Every method is computed for all points of
+all cycles in one pass per window position; windows never reach across
+cycles and get shorter at the ends of each cycle. Non-finite y values are
+left out of the fit and stay non-finite in the output.
+
+Methods:
+'rolling'           trailing mean of window points, NaN for the first
+                    window-1 points of each cycle (same as pandas
+                    rolling(window).mean())
+'savitzky_golay'    least-squares polynomial of the given order fitted to
+                    the window centered on each point (Savitzky-Golay)
+'gaussian'          weighted mean of the window with Gaussian weights;
+                    standard deviation is window/6 points
+'lowess'            local linear fit with tricube weights on the distance
+                    in x (LOWESS without the robustness iterations)
+"""
+
+import numpy as np
+
+
+METHODS = ('rolling', 'savitzky_golay', 'gaussian', 'lowess')
+
+
+def _row_bounds(n_points, offsets):
+    """Start and stop row of the cycle that each point belongs to."""
+    if offsets is None:
+        offsets = [0, n_points]
+    offsets = np.asarray(offsets)
+    lengths = np.diff(offsets)
+    return np.repeat(offsets[:-1], lengths), np.repeat(offsets[1:], lengths)
+
+
+def _neighbours(points, shift, starts, stops, finite):
+    """Rows of the neighbour at shift points from each point, clipped to
+    the array, and whether that neighbour is in the same cycle and finite."""
+    rows = points + shift
+    valid = (rows >= starts) & (rows < stops)
+    rows = np.clip(rows, 0, max(len(points) - 1, 0))
+    return rows, valid & finite[rows]
+
+
+def rolling_mean(y, offsets=None, window=3):
+    """
+    Function to compute the trailing mean of window points for each cycle.
+
+    Arguments:
+    y = 1D numpy array of all cycles concatenated
+    offsets = cycle i is y[offsets[i]:offsets[i+1]]; None if y is one cycle
+    window = number of points
+
+    Returns:
+    1D numpy array like y; NaN for the first window-1 points of each cycle
+    and where the window has a NaN
+    """
+    y = np.asarray(y, dtype=float)
+    points = np.arange(len(y))
+    starts, stops = _row_bounds(len(y), offsets)
+    total = np.zeros(len(y))
+    for shift in range(-window + 1, 1):
+        rows, valid = _neighbours(points, shift, starts, stops, np.ones(len(y), dtype=bool))
+        total += np.where(valid, y[rows], np.nan)
+    return total/window
+
+
+def local_polynomial(x, y, offsets=None, window=11, order=2, kernel='uniform'):
+    """
+    Function to fit a weighted polynomial in x to the window centered on
+    each point and return its value at that point. All points of all cycles
+    are fitted at once: the weighted sums of the normal equations are
+    accumulated over the window positions and the small systems are solved
+    as one batch.
+
+    Arguments:
+    x, y = 1D numpy arrays of all cycles concatenated
+    offsets = cycle i is rows offsets[i]:offsets[i+1]; None if one cycle
+    window = number of points in the window; made odd by adding 1
+    order = order of the polynomial
+    kernel = weights of the points in the window: 'uniform', 'gaussian'
+    (in points from the center) or 'tricube' (in x distance from the center)
+
+    Returns:
+    1D numpy array of smoothed y; NaN where y is not finite
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    half = window//2
+    points = np.arange(len(y))
+    starts, stops = _row_bounds(len(y), offsets)
+    finite = np.isfinite(x) & np.isfinite(y)
+    shifts = range(-half, half + 1)
+
+    # Scale x distances in each window to [-1, 1] to keep the fit well conditioned
+    scale = np.zeros(len(y))
+    for shift in shifts:
+        rows, valid = _neighbours(points, shift, starts, stops, finite)
+        scale = np.maximum(scale, np.where(valid, np.abs(x[rows] - x), 0))
+    scale[scale == 0] = 1
+
+    # Normal equations: A[i, j] = sum(w*d^(i+j)), b[i] = sum(w*d^i*y)
+    moments = np.zeros((2*order + 1, len(y)))
+    rhs = np.zeros((order + 1, len(y)))
+    count = np.zeros(len(y), dtype=int)
+    for shift in shifts:
+        rows, valid = _neighbours(points, shift, starts, stops, finite)
+        distance = (x[rows] - x)/scale
+        if kernel == 'gaussian':
+            weight = np.full(len(y), np.exp(-0.5*(shift/(window/6))**2))
+        elif kernel == 'tricube':
+            weight = (1 - np.minimum(np.abs(distance), 1)**3)**3
+        else:
+            weight = np.ones(len(y))
+        weight = np.where(valid, weight, 0)
+        count += valid & (weight > 0)
+        y_rows = np.where(valid, y[rows], 0)
+        power = weight
+        for m in range(2*order + 1):
+            moments[m] += power
+            if m <= order:
+                rhs[m] += power*y_rows
+            power = power*distance
+
+    a = moments[np.add.outer(np.arange(order + 1), np.arange(order + 1))].transpose(2, 0, 1)
+    b = rhs.T.copy()
+    # Too few points for the polynomial, e.g. very short cycles: keep y
+    few = count < order + 1
+    a[few] = np.eye(order + 1)
+    b[few] = 0
+    b[few, 0] = np.where(finite[few], y[few], 0)
+    smoothed = np.linalg.solve(a, b[..., None])[:, 0, 0]
+    return np.where(finite, smoothed, np.nan)
+
+
+def smooth(x, y, offsets=None, method='savitzky_golay', window=11, order=2):
+    """
+    Function to smooth the curves of all cycles in one call.
+
+    Arguments:
+    x, y = 1D numpy arrays of all cycles concatenated, e.g. the voltage and
+    dQ/dV columns of a cycle store
+    offsets = cycle i is rows offsets[i]:offsets[i+1]; None if one cycle
+    method = one of METHODS (see above); None or 'None' returns y unchanged
+    window = number of points in the window
+    order = order of the polynomial for 'savitzky_golay'
+
+    Returns:
+    1D numpy array of smoothed y
+    """
+    if method is None or method == 'None':
+        return np.asarray(y)
+    method = method.replace('-', '_')
+    if method == 'rolling':
+        return rolling_mean(y, offsets, window)
+    if method == 'savitzky_golay':
+        return local_polynomial(x, y, offsets, window, order)
+    if method == 'gaussian':
+        return local_polynomial(x, y, offsets, window, 0, 'gaussian')
+    if method == 'lowess':
+        return local_polynomial(x, y, offsets, window, 1, 'tricube')
+    raise ValueError('Smoothing method must be None or one of ' + ', '.join(METHODS) + ', not ' + repr(method))